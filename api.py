@@ -0,0 +1,439 @@
+import argparse
+import asyncio
+import json
+import re
+import sqlite3
+import types
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qsl, urlsplit
+
+import availability
+import bookings
+import columnar
+import db
+import notifications
+import passwords
+import pricing
+import reports
+import routes
+import service
+import sessions
+import shards
+import tracing
+import trips
+
+MAX_BODY = 1024 * 1024
+REASONS = {200: "OK", 201: "Created", 400: "Bad Request", 401: "Unauthorized", 403: "Forbidden", 404: "Not Found",
+           405: "Method Not Allowed", 409: "Conflict", 413: "Payload Too Large", 429: "Too Many Requests",
+           500: "Internal Server Error", 503: "Service Unavailable"}
+
+
+class HTTPError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+def _records(columns, rows):
+    return [dict(zip(columns, row)) for row in rows]
+
+
+def _require(data, *fields):
+    missing = [field for field in fields if data.get(field) in (None, "")]
+    if missing:
+        raise HTTPError(400, f"Missing fields: {', '.join(missing)}")
+    return [data[field] for field in fields]
+
+
+def _quote_record(quote):
+    return quote._asdict()
+
+
+def _dates(data, start, end):
+    # Optional date range for a booking; both ends or neither
+    if data.get(start) in (None, "") and data.get(end) in (None, ""):
+        return None
+    return tuple(_require(data, start, end))
+
+
+def _user(params, data=None):
+    # The caller's UserID, from the bearer token /login issued. A user_id the
+    # client also sends must be that same user.
+    user_id = sessions.user_id(params.get("token"))
+    if user_id is None:
+        raise HTTPError(401, "Log in and send the token as 'Authorization: Bearer <token>'")
+    claimed = (data or {}).get("user_id")
+    if claimed not in (None, ""):
+        try:
+            claimed = int(claimed)
+        except (TypeError, ValueError):
+            raise HTTPError(400, "user_id must be an integer")
+        if claimed != user_id:
+            raise HTTPError(403, "Bookings can only be managed by their own user")
+    return user_id
+
+
+def _admin(params):
+    # Admin routes take the session of a user listed in TRAVEL_BOOKING_ADMINS
+    user = service.get_user(_user(params))
+    if user is None or not sessions.is_admin(user["Username"]):
+        raise HTTPError(403, "Admins only")
+
+
+# Handlers are plain blocking functions run on the worker pool:
+# handler(params, query, body) -> (status, payload)
+
+def health(params, query, body):
+    return 200, {"status": "ok"}
+
+def stats(params, query, body):
+    _admin(params)
+    return 200, service.stats()
+
+def metrics(params, query, body):
+    _admin(params)
+    lines = [tracing.tracer.prometheus()]
+    current = service.stats()
+    for section in ("pool", "lookups", "searches", "notifications"):
+        for name, value in sorted(current[section].items()):
+            if isinstance(value, (int, float)):
+                lines.append(f"travel_booking_{section}_{name} {value}\n")
+    return 200, "".join(lines)
+
+def airports(params, query, body):
+    return 200, service.get_airports()
+
+def hotel_locations(params, query, body):
+    return 200, service.get_hotels_locations()
+
+def car_locations(params, query, body):
+    return 200, service.get_car_pickup_locations()
+
+def _paged(columns, page, query, *args):
+    try:
+        limit = int(query.get("limit", service.PAGE_SIZE))
+    except ValueError:
+        raise HTTPError(400, "limit must be an integer")
+    if query.get("stream") in ("1", "true"):
+        # Every page from the cursor on, streamed as one NDJSON line per page
+        def events():
+            after = query.get("cursor")
+            while True:
+                rows, after = page(*args, after=after, limit=limit)
+                yield {"results": _records(columns, rows), "next_cursor": after}
+                if after is None:
+                    return
+        return 200, events()
+    rows, next_cursor = page(*args, after=query.get("cursor"), limit=limit)
+    return 200, {"results": _records(columns, rows), "next_cursor": next_cursor}
+
+def flights(params, query, body):
+    dept, arrival, date = _require(query, "from", "to", "date")
+    return _paged(service.FLIGHT_COLUMNS, service.search_flights_page, query, dept, arrival, date)
+
+def hotels(params, query, body):
+    location, entry, exit = _require(query, "location", "checkin", "checkout")
+    return _paged(service.HOTEL_COLUMNS, service.search_hotels_page, query, location, entry, exit)
+
+def cars(params, query, body):
+    location, pickup, drop = _require(query, "location", "pickup", "drop")
+    return _paged(service.CAR_COLUMNS, service.search_cars_page, query, location, pickup, drop)
+
+def route_search(params, query, body):
+    origin, destination, date = _require(query, "from", "to", "date")
+    try:
+        stops = int(query.get("stops", routes.MAX_STOPS))
+        limit = int(query.get("limit", routes.ROUTE_LIMIT))
+    except ValueError:
+        raise HTTPError(400, "stops and limit must be integers")
+    itineraries = routes.search_routes(origin, destination, date, stops, query.get("sort", "price"), limit)
+    return 200, [{"price": itinerary.price, "minutes": itinerary.minutes, "stops": itinerary.stops,
+                  "legs": _records(routes.LEG_COLUMNS, itinerary.legs)} for itinerary in itineraries]
+
+def revenue_report(params, query, body):
+    _admin(params)
+    return 200, _records(["day", "bookings", "payments", "revenue"], reports.revenue_by_day(query.get("from"), query.get("to")))
+
+def bookings_report(params, query, body):
+    _admin(params)
+    return 200, _records(["name", "bookings"], reports.bookings_by(query.get("by", "airline")))
+
+def payments_report(params, query, body):
+    _admin(params)
+    return 200, _records(["method", "payments", "amount"], reports.payment_methods())
+
+def quote(params, query, body):
+    flight, hotel, car = _require(query, "flight", "hotel", "car")
+    return 200, _quote_record(service.quote(flight, hotel, car))
+
+def trip_search(params, query, body):
+    trip = trips.Trip(*_require(query, "from", "to", "date", "hotel_location", "checkin", "checkout",
+                                "car_location", "pickup", "drop"))
+    limit = int(query.get("limit", trips.BUNDLE_LIMIT))
+    columns = {"flights": service.FLIGHT_COLUMNS, "hotels": service.HOTEL_COLUMNS, "cars": service.CAR_COLUMNS}
+
+    def events():
+        for kind, rows in trips.search_trip_stream(trip, limit):
+            if kind == "bundles":
+                rows = [{"total": bundle.total,
+                         "flight": dict(zip(service.FLIGHT_COLUMNS, bundle.flight)),
+                         "hotel": dict(zip(service.HOTEL_COLUMNS, bundle.hotel)),
+                         "car": dict(zip(service.CAR_COLUMNS, bundle.car))} for bundle in rows]
+            else:
+                rows = _records(columns[kind], rows)
+            yield {"kind": kind, "results": rows}
+
+    if query.get("stream") in ("1", "true"):
+        # Streamed as newline-delimited JSON, one line per search as it completes
+        return 200, events()
+    return 200, {event["kind"]: event["results"] for event in events()}
+
+def create_user(params, query, body):
+    username, password, email = _require(body, "username", "password", "email")
+    user_id = service.create_user(username, password, email, body.get("phone_no"))
+    return 201, {"user_id": user_id}
+
+def login(params, query, body):
+    username, password = _require(body, "username", "password")
+    user, user_id = service.login_user(username, password, params.get("client"))
+    if not user:
+        raise HTTPError(401, "Invalid username or password")
+    return 200, {"user_id": user_id, "username": user["Username"], "email": user["Email"],
+                 "token": sessions.issue(user_id), "expires_in": sessions.TTL}
+
+def list_bookings(params, query, body):
+    user_id = _user(params, params)
+    return _paged(service.BOOKING_COLUMNS, service.list_bookings_page, query, user_id)
+
+def create_booking(params, query, body):
+    user_id = _user(params, body)
+    flight, hotel, car = _require(body, "flight", "hotel", "car")
+    booking_id, booking_quote = service.book(user_id, flight, hotel, car,
+                                             _dates(body, "checkin", "checkout"), _dates(body, "pickup", "drop"))
+    return 201, {"booking_id": booking_id, "quote": _quote_record(booking_quote)}
+
+def modify_booking(params, query, body):
+    user_id = _user(params, body)
+    flight, hotel, car = _require(body, "flight", "hotel", "car")
+    booking_quote = service.modify_booking(params["booking_id"], user_id, flight, hotel, car,
+                                           _dates(body, "checkin", "checkout"), _dates(body, "pickup", "drop"))
+    return 200, {"booking_id": params["booking_id"], "quote": _quote_record(booking_quote)}
+
+def cancel_booking(params, query, body):
+    user_id = _user(params, query)
+    if not service.cancel_booking(params["booking_id"], user_id):
+        raise HTTPError(404, "Booking not found")
+    return 200, {"booking_id": params["booking_id"], "canceled": True}
+
+
+ROUTES = [
+    ("GET", r"/health", health),
+    ("GET", r"/stats", stats),
+    ("GET", r"/metrics", metrics),
+    ("GET", r"/airports", airports),
+    ("GET", r"/hotels/locations", hotel_locations),
+    ("GET", r"/cars/locations", car_locations),
+    ("GET", r"/flights", flights),
+    ("GET", r"/hotels", hotels),
+    ("GET", r"/cars", cars),
+    ("GET", r"/routes", route_search),
+    ("GET", r"/reports/revenue", revenue_report),
+    ("GET", r"/reports/bookings", bookings_report),
+    ("GET", r"/reports/payments", payments_report),
+    ("GET", r"/quote", quote),
+    ("GET", r"/trips", trip_search),
+    ("POST", r"/users", create_user),
+    ("POST", r"/login", login),
+    ("GET", r"/users/(?P<user_id>\d+)/bookings", list_bookings),
+    ("POST", r"/bookings", create_booking),
+    ("PUT", r"/bookings/(?P<booking_id>[^/]+)", modify_booking),
+    ("DELETE", r"/bookings/(?P<booking_id>[^/]+)", cancel_booking),
+]
+ROUTES = [(method, re.compile(pattern + "$"), handler) for method, pattern, handler in ROUTES]
+
+
+def dispatch(method, target, raw_body, client=None, token=None):
+    url = urlsplit(target)
+    allowed = False
+    for route_method, pattern, handler in ROUTES:
+        match = pattern.match(url.path)
+        if not match:
+            continue
+        allowed = True
+        if route_method != method:
+            continue
+        query = dict(parse_qsl(url.query))
+        try:
+            body = json.loads(raw_body) if raw_body else {}
+        except ValueError:
+            raise HTTPError(400, "Body is not valid JSON")
+        if not isinstance(body, dict):
+            raise HTTPError(400, "Body must be a JSON object")
+        params = match.groupdict()
+        if client:
+            params["client"] = client
+        if token:
+            params["token"] = token
+        try:
+            return handler(params, query, body)
+        except pricing.UnknownItem as e:
+            raise HTTPError(400, str(e))
+        except service.InvalidCursor:
+            raise HTTPError(400, "Invalid cursor")
+        except service.BookingNotFound:
+            raise HTTPError(404, "Booking not found")
+        except availability.Unavailable as e:
+            raise HTTPError(409, str(e))
+        except passwords.TooManyAttempts as e:
+            raise HTTPError(429, str(e))
+        except passwords.Busy as e:
+            raise HTTPError(503, str(e))
+        except ValueError as e:
+            # Malformed dates and the like in the query or body
+            raise HTTPError(400, str(e))
+        except sqlite3.IntegrityError as e:
+            raise HTTPError(409, str(e))
+    raise HTTPError(405 if allowed else 404, "Method not allowed" if allowed else "Not found")
+
+
+class Server:
+    def __init__(self, host="127.0.0.1", port=8000, workers=None):
+        self.host = host
+        self.port = port
+        # One worker per pooled connection; more would only queue on the pool
+        self.executor = ThreadPoolExecutor(max_workers=workers or db.get_pool().max_size)
+
+    async def handle(self, reader, writer):
+        loop = asyncio.get_running_loop()
+        peer = writer.get_extra_info("peername")
+        client = peer[0] if peer else None
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                try:
+                    method, target, version = request_line.decode("latin-1").split()
+                except ValueError:
+                    await self.respond(writer, 400, {"error": "Malformed request line"}, False)
+                    break
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+
+                keep_alive = headers.get("connection", "").lower() != "close" and version == "HTTP/1.1"
+                try:
+                    length = int(headers.get("content-length") or 0)
+                    if length < 0:
+                        raise ValueError(length)
+                except ValueError:
+                    await self.respond(writer, 400, {"error": "Malformed Content-Length"}, False)
+                    break
+                if length > MAX_BODY:
+                    await self.respond(writer, 413, {"error": "Body too large"}, False)
+                    break
+                raw_body = await reader.readexactly(length) if length else b""
+                scheme, _, token = headers.get("authorization", "").partition(" ")
+                token = token.strip() if scheme.lower() == "bearer" else None
+
+                try:
+                    status, payload = await loop.run_in_executor(self.executor, dispatch, method, target, raw_body, client, token)
+                except HTTPError as e:
+                    status, payload = e.status, {"error": e.message}
+                except Exception as e:
+                    status, payload = 500, {"error": f"{type(e).__name__}: {e}"}
+                if isinstance(payload, types.GeneratorType):
+                    await self.stream(writer, status, payload, keep_alive)
+                else:
+                    await self.respond(writer, status, payload, keep_alive)
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def respond(self, writer, status, payload, keep_alive):
+        if isinstance(payload, str):
+            # Plain text, e.g. the Prometheus exposition format from /metrics
+            body = payload.encode("utf-8")
+            content_type = "text/plain; version=0.0.4"
+        else:
+            body = json.dumps(payload, default=str).encode("utf-8")
+            content_type = "application/json"
+        head = (f"HTTP/1.1 {status} {REASONS.get(status, '')}\r\n"
+                f"Content-Type: {content_type}\r\n"
+                f"Content-Length: {len(body)}\r\n"
+                f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n")
+        writer.write(head.encode("latin-1") + body)
+        await writer.drain()
+
+    async def stream(self, writer, status, events, keep_alive):
+        loop = asyncio.get_running_loop()
+        head = (f"HTTP/1.1 {status} {REASONS.get(status, '')}\r\n"
+                f"Content-Type: application/x-ndjson\r\n"
+                f"Transfer-Encoding: chunked\r\n"
+                f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n")
+        writer.write(head.encode("latin-1"))
+        done = object()
+        while True:
+            try:
+                event = await loop.run_in_executor(self.executor, next, events, done)
+            except Exception as e:
+                event = {"error": f"{type(e).__name__}: {e}"}
+            if event is done:
+                break
+            line = json.dumps(event, default=str).encode("utf-8") + b"\n"
+            writer.write(f"{len(line):x}\r\n".encode("latin-1") + line + b"\r\n")
+            await writer.drain()
+            if "error" in event:
+                break
+        writer.write(b"0\r\n\r\n")
+        await writer.drain()
+
+    async def serve(self):
+        server = await asyncio.start_server(self.handle, self.host, self.port)
+        async with server:
+            await server.serve_forever()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="JSON HTTP API for the travel booking service.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--db", default=db.DB_PATH, help="database file (default: %(default)s)")
+    parser.add_argument("--workers", type=int, help="worker threads and pooled connections (default: pool size)")
+    parser.add_argument("--slow-query-ms", type=float, default=tracing.SLOW_QUERY_MS,
+                        help="log queries slower than this to the slow query log (default: %(default)s)")
+    parser.add_argument("--slow-query-log", default=tracing.SLOW_QUERY_LOG, help="slow query log file (default: %(default)s)")
+    parser.add_argument("--search-engine", choices=columnar.ENGINES, default=columnar.ENGINE,
+                        help="answer flight, hotel and car searches from SQLite or an in-memory columnar snapshot (default: %(default)s)")
+    parser.add_argument("--group-commit", action="store_true", default=bookings.GROUP_COMMIT,
+                        help="commit concurrent booking writes together in batches")
+    parser.add_argument("--notification-workers", type=int, default=notifications.WORKERS,
+                        help="threads delivering queued notifications; 0 leaves them to notifications.py (default: %(default)s)")
+    parser.add_argument("--shards", type=int, default=shards.SHARDS,
+                        help="shard files holding users and bookings, 0 for none (default: %(default)s)")
+    args = parser.parse_args()
+
+    tracing.configure_slow_log(args.slow_query_log, args.slow_query_ms)
+    columnar.configure(args.search_engine)
+    bookings.configure(args.group_commit)
+    shards.configure(args.shards)
+
+    if args.workers:
+        db.configure(args.db, max_size=args.workers)
+    else:
+        db.configure(args.db)
+    if args.notification_workers:
+        notifications.dispatcher.workers = args.notification_workers
+        notifications.dispatcher.start()
+    if shards.enabled():
+        bookings.start_reconciler()
+    print(f"Serving on http://{args.host}:{args.port}")
+    asyncio.run(Server(args.host, args.port, args.workers).serve())
@@ -0,0 +1,158 @@
+import json
+from collections import namedtuple
+from datetime import date
+
+# Rooms on sale per hotel listing per night; the Hotels table has no room count
+HOTEL_ROOMS = 10
+# Days are stored as integers counted from 1970-01-01, so a stay is a contiguous
+# range of primary key values and range checks are plain integer comparisons
+EPOCH = date(1970, 1, 1).toordinal()
+
+
+def day_sql(column):
+    return f"CAST(julianday({column}) - 2440587.5 AS INTEGER)"
+
+
+# How each kind of inventory maps onto its availability table. Availability rows
+# are keyed by the listing's rowid; the listing covers the days first..last.
+Inventory = namedtuple("Inventory", ["table", "availability", "item_column", "first_day", "last_day", "capacity"])
+
+KINDS = {
+    # A hotel listing sells the nights from EntryDate up to, not including, ExitDate
+    "hotel": Inventory("Hotels", "HotelAvailability", "HotelID", day_sql("EntryDate"), day_sql("ExitDate") + " - 1",
+                       str(HOTEL_ROOMS)),
+    # A car listing is one car, out from PickupDate through DropDate
+    "car": Inventory("Cars", "CarAvailability", "CarID", day_sql("PickupDate"), day_sql("DropDate"),
+                     "CASE IsAvailable WHEN 'No' THEN 0 ELSE 1 END"),
+}
+
+
+class Unavailable(LookupError):
+    pass
+
+
+def day_number(text):
+    return date.fromisoformat(text).toordinal() - EPOCH
+
+
+def hotel_days(entry_date, exit_date):
+    # Nights from check-in to the night before check-out; a same-day stay counts as
+    # one night. A check-out before check-in gives an empty range (last < first),
+    # as car_days does for a drop before pickup.
+    first, exit = day_number(entry_date), day_number(exit_date)
+    if exit < first:
+        return first, first - 1
+    return first, max(exit - 1, first)
+
+
+def car_days(pickup_date, drop_date):
+    return day_number(pickup_date), day_number(drop_date)
+
+
+def available_sql(kind, listing):
+    # WHERE fragment that holds when `listing` has capacity left on every day of a
+    # range; takes (first, last, number of days) and reads only that range of the key
+    inventory = KINDS[kind]
+    return (f"(SELECT COUNT(*) FROM {inventory.availability} WHERE ItemRow = {listing}"
+            f" AND Day BETWEEN ? AND ? AND Capacity > 0) = ?")
+
+
+def available_params(days):
+    first, last = days
+    return first, last, last - first + 1
+
+
+def populate(conn, kind):
+    # Adds a row for every day of every listing that does not have one yet. The
+    # Hotels and Cars writers (create.py, bulk_load.py, benchmark.py) call this after
+    # inserting inventory; triggers cannot do it because they cannot use WITH.
+    inventory = KINDS[kind]
+    return conn.execute(f'''
+        WITH RECURSIVE days (ItemRow, Day, LastDay, Capacity) AS (
+            SELECT rowid, {inventory.first_day}, {inventory.last_day}, {inventory.capacity} FROM {inventory.table}
+            WHERE {inventory.first_day} <= {inventory.last_day}
+            UNION ALL
+            SELECT ItemRow, Day + 1, LastDay, Capacity FROM days WHERE Day < LastDay
+        )
+        INSERT OR IGNORE INTO {inventory.availability} (ItemRow, Day, Capacity)
+        SELECT ItemRow, Day, Capacity FROM days
+    ''').rowcount
+
+
+def reserve(conn, booking_id, kind, item_id, days=None):
+    # Takes one unit from the first listing of the item with capacity left on every
+    # day, either of the given (first, last) range or, for bookings made by name
+    # alone, of the listing's own dates. Picking the listing and decrementing it is a
+    # single UPDATE, so two bookings can never both take the last unit.
+    inventory = KINDS[kind]
+    if days is None:
+        held = f"ItemRow = {inventory.table}.rowid"
+        listing = (f"EXISTS (SELECT 1 FROM {inventory.availability} WHERE {held})"
+                   f" AND NOT EXISTS (SELECT 1 FROM {inventory.availability} WHERE {held} AND Capacity <= 0)")
+        in_range, params = "", (item_id,)
+    else:
+        listing = available_sql(kind, inventory.table + ".rowid")
+        in_range, params = " AND Day BETWEEN ? AND ?", (item_id,) + available_params(days) + days
+    rows = conn.execute(f'''
+        UPDATE {inventory.availability} SET Capacity = Capacity - 1
+        WHERE ItemRow = (
+            SELECT rowid FROM {inventory.table}
+            WHERE {inventory.item_column} = ? AND {listing}
+            ORDER BY rowid LIMIT 1
+        ){in_range}
+        RETURNING ItemRow, Day
+    ''', params).fetchall()
+    if not rows:
+        raise Unavailable(f"No {kind} available for item {item_id} on the requested dates")
+    conn.execute("INSERT INTO BookingInventory (BookingID, Kind, ItemRow, FirstDay, LastDay) VALUES (?, ?, ?, ?, ?)",
+                 (booking_id, kind, rows[0][0], min(row[1] for row in rows), max(row[1] for row in rows)))
+    return rows[0][0]
+
+
+def holdings(conn, booking_id):
+    # What the booking holds now, as (kind, row, first, last) ranges
+    return [tuple(row) for row in conn.execute(
+        "SELECT Kind, ItemRow, FirstDay, LastDay FROM BookingInventory WHERE BookingID = ?", (booking_id,))]
+
+
+def release(conn, booking_id):
+    # Gives back everything the booking holds. Deleting the records first takes the
+    # write lock, so a booking canceled twice at once is only restored once.
+    held = conn.execute("DELETE FROM BookingInventory WHERE BookingID = ? RETURNING Kind, ItemRow, FirstDay, LastDay",
+                        (booking_id,)).fetchall()
+    for kind, item_row, first, last in held:
+        conn.execute(f"UPDATE {KINDS[kind].availability} SET Capacity = Capacity + 1 WHERE ItemRow = ? AND Day BETWEEN ? AND ?",
+                     (item_row, first, last))
+    return held
+
+
+def restore(conn, booking_id, held):
+    # Undoes a committed release: gives back whatever the booking holds now and
+    # takes the released (kind, row, first, last) ranges again
+    release(conn, booking_id)
+    for kind, item_row, first, last in held:
+        conn.execute(f"UPDATE {KINDS[kind].availability} SET Capacity = Capacity - 1 WHERE ItemRow = ? AND Day BETWEEN ? AND ?",
+                     (item_row, first, last))
+        conn.execute("INSERT INTO BookingInventory (BookingID, Kind, ItemRow, FirstDay, LastDay) VALUES (?, ?, ?, ?, ?)",
+                     (booking_id, kind, item_row, first, last))
+
+
+def journal(conn, booking_id, user_id, held):
+    # Records a capacity change that commits ahead of the shard write it belongs to,
+    # with what the booking held before it; returns the change's ID
+    return conn.execute("INSERT INTO CapacityJournal (BookingID, UserID, Held) VALUES (?, ?, ?) RETURNING ChangeID",
+                        (booking_id, user_id, json.dumps(held))).fetchone()[0]
+
+
+def settle(conn, change_ids, applied):
+    # Drops journaled changes, undoing those not in applied: their shard write never
+    # committed. Each row is claimed by deleting it, so a change is undone at most once
+    # however many processes settle it. Returns how many were undone.
+    undone = 0
+    for change_id in change_ids:
+        row = conn.execute("DELETE FROM CapacityJournal WHERE ChangeID = ? RETURNING BookingID, Held",
+                           (change_id,)).fetchone()
+        if row is not None and change_id not in applied:
+            restore(conn, row[0], [tuple(held) for held in json.loads(row[1])])
+            undone += 1
+    return undone
@@ -0,0 +1,381 @@
+import argparse
+import glob
+import json
+import os
+import platform
+import random
+import sqlite3
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+
+import availability
+import bookings
+import cache
+import columnar
+import db
+import migrations
+import passwords
+import routes
+import service
+import shards
+
+AIRLINES = ["Delta", "United", "Quantas", "Southwest", "American", "Alaska", "JetBlue", "Spirit", "Frontier", "Hawaiian"]
+HOTEL_NAMES = ["Grand Hotel", "Beach Resort", "Hilton Garden", "Marriott Inn", "Hyatt Hotel", "Holiday Inn", "Ritz Carlton", "Westin"]
+CAR_TYPES = ["SUV", "Sedan", "Convertible", "Mini", "Truck", "Van", "Coupe"]
+RENTAL_COMPANIES = ["Avis", "Hertz", "Rentaz", "Pablo Carz", "Zipcar", "Enterprise", "Budget"]
+START_DATE = date(2025, 1, 1)
+BATCH_SIZE = 10000
+HEAVY_MODULES = ("pandas", "numpy", "pyarrow")
+
+# Run in a fresh interpreter per sample, so every import is a cold one. The app's
+# own modules are imported before the first render so the two are timed apart.
+STARTUP_PROBE = '''
+import json, sys, time
+start = time.perf_counter()
+from streamlit.testing.v1 import AppTest
+streamlit_ms = (time.perf_counter() - start) * 1000
+start = time.perf_counter()
+import availability, notifications, passwords, reports, routes, service, tracing, trips
+app_ms = (time.perf_counter() - start) * 1000
+app = AppTest.from_file(sys.argv[1], default_timeout=60)
+start = time.perf_counter()
+app.run()
+first_render_ms = (time.perf_counter() - start) * 1000
+start = time.perf_counter()
+app.run()
+rerun_ms = (time.perf_counter() - start) * 1000
+print(json.dumps({"import_streamlit_ms": streamlit_ms, "import_app_ms": app_ms, "first_render_ms": first_render_ms,
+                  "rerun_ms": rerun_ms, "error": str(app.exception[0].message) if app.exception else None,
+                  "loaded": [name for name in sys.argv[2:] if name in sys.modules]}))
+'''
+
+
+
+def _batches(rows, size=BATCH_SIZE):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def generate(path, flights=100000, hotels=20000, cars=20000, users=1000, bookings=5000, days=365,
+             airports=60, locations=200, seed=1):
+    # Builds a fresh database in the create.py schema with synthetic inventory
+    rng = random.Random(seed)
+    if os.path.exists(path):
+        os.remove(path)
+    # Shard files split from an earlier database would mix its users into this one
+    stem, ext = os.path.splitext(path)
+    for shard in glob.glob(glob.escape(stem) + ".shard*" + (ext or ".db") + "*"):
+        os.remove(shard)
+    conn = sqlite3.connect(path)
+    migrations.migrate(conn)
+    conn.execute("PRAGMA synchronous = OFF")
+
+    def day(offset):
+        return (START_DATE + timedelta(days=offset)).strftime('%Y-%m-%d')
+
+    airport_codes = [f"A{i:02d}" for i in range(airports)]
+    cities = [f"City {i}" for i in range(locations)]
+    pickups = [f"{i} Airport Rd" for i in range(locations)]
+
+    conn.executemany("INSERT INTO FlightInfo (Airline) VALUES (?)", [(name,) for name in AIRLINES])
+    conn.executemany("INSERT INTO HotelInfo (HotelName) VALUES (?)", [(name,) for name in HOTEL_NAMES])
+    conn.executemany("INSERT INTO CarsInfo (CarType) VALUES (?)", [(name,) for name in CAR_TYPES])
+
+    def flight_rows():
+        for i in range(flights):
+            dept, arrival = rng.sample(airport_codes, 2)
+            dept_day = rng.randrange(days)
+            hour = rng.randrange(5, 22)
+            yield (rng.randrange(len(AIRLINES)) + 1, f"FL{i}", dept, arrival, day(dept_day), f"{hour:02d}:00:00",
+                   day(dept_day), f"{min(hour + rng.randrange(1, 6), 23):02d}:30:00", round(rng.uniform(80, 900), 2))
+
+    def hotel_rows():
+        for _ in range(hotels):
+            entry = rng.randrange(days)
+            yield (rng.randrange(len(HOTEL_NAMES)) + 1, rng.choice(cities), round(rng.uniform(60, 600), 2),
+                   round(rng.uniform(2.5, 5.0), 1), day(entry), "15:00:00", day(entry + rng.randrange(1, 30)), "11:00:00")
+
+    def car_rows():
+        for _ in range(cars):
+            pickup = rng.randrange(days)
+            yield (rng.randrange(len(CAR_TYPES)) + 1, rng.choice(RENTAL_COMPANIES), rng.choice(["Yes", "Yes", "No"]),
+                   rng.choice(pickups), rng.choice(pickups), round(rng.uniform(25, 150), 2),
+                   day(pickup), "09:00:00", day(pickup + rng.randrange(1, 14)), "17:00:00")
+
+    def user_rows():
+        # Hashing is the slow part of making users, so spread it over the hash workers
+        with ThreadPoolExecutor(max_workers=passwords.HASH_WORKERS) as executor:
+            hashes = executor.map(service.hash_password, (f"pass{i}" for i in range(users)))
+            for i, hashed in enumerate(hashes):
+                yield (f"user{i}", hashed, f"user{i}@example.com", None, day(0), "00:00:00")
+
+    def booking_rows():
+        for i in range(bookings):
+            yield (f"B{i + 1}", rng.randrange(users) + 1, rng.randrange(len(AIRLINES)) + 1,
+                   rng.randrange(len(HOTEL_NAMES)) + 1, rng.randrange(len(CAR_TYPES)) + 1, day(0), round(rng.uniform(200, 2000), 2))
+
+    inserts = [
+        ("INSERT INTO Flights VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", flight_rows()),
+        ("INSERT INTO Hotels VALUES (?, ?, ?, ?, ?, ?, ?, ?)", hotel_rows()),
+        ("INSERT INTO Cars VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", car_rows()),
+        ("INSERT INTO Users (Username, Password, Email, PhoneNo, CDate, CTime) VALUES (?, ?, ?, ?, ?, ?)", user_rows()),
+        ("INSERT INTO Booking VALUES (?, ?, ?, ?, ?, ?, ?)", booking_rows()),
+    ]
+    for sql, rows in inserts:
+        for batch in _batches(rows):
+            conn.executemany(sql, batch)
+    for kind in availability.KINDS:
+        availability.populate(conn, kind)
+    conn.execute("UPDATE BookingSequence SET NextValue = ? WHERE Name = 'Booking'", (bookings + 1,))
+    conn.commit()
+    conn.execute("ANALYZE")
+    conn.close()
+
+
+def sample_params(path, count=2000, seed=2, shard_count=0):
+    # Search parameters drawn from real rows, so most searches return results;
+    # users and bookings come from the shard files when sharded
+    conn = sqlite3.connect(path)
+    user_conns = [sqlite3.connect(shard) for shard in shards.shard_paths(path, shard_count)] if shard_count else [conn]
+    rng = random.Random(seed)
+
+    def sample(sql, conns=(conn,)):
+        rows = [row for source in conns for row in source.execute(sql).fetchall()]
+        return [rng.choice(rows) for _ in range(count)] if rows else []
+
+    params = {
+        "flights": sample(f"SELECT DeptAirport, ArrivalAirport, DeptDate FROM Flights ORDER BY RANDOM() LIMIT {count}"),
+        "hotels": sample(f"SELECT Address, EntryDate, ExitDate FROM Hotels ORDER BY RANDOM() LIMIT {count}"),
+        "cars": sample(f"SELECT PickupLocation, PickupDate, DropDate FROM Cars ORDER BY RANDOM() LIMIT {count}"),
+        "users": sample(f"SELECT UserID, Username FROM Users ORDER BY RANDOM() LIMIT {count}", user_conns),
+        "bookings": sample(f"SELECT BookingID, UserID FROM Booking ORDER BY RANDOM() LIMIT {count}", user_conns),
+    }
+    for source in set(user_conns + [conn]):
+        source.close()
+    return params
+
+
+def make_operations(params):
+    booked = deque()
+
+    def itinerary(rng):
+        return rng.choice(AIRLINES), rng.choice(HOTEL_NAMES), rng.choice(CAR_TYPES)
+
+    def login(rng):
+        user_id, username = rng.choice(params["users"])
+        return service.login_user(username, f"pass{username[4:]}")
+
+    def book(rng):
+        user_id, _ = rng.choice(params["users"])
+        booking_id, _ = service.book(user_id, *itinerary(rng))
+        booked.append((booking_id, user_id))
+
+    def modify(rng):
+        booking_id, user_id = rng.choice(params["bookings"])
+        service.modify_booking(booking_id, user_id, *itinerary(rng))
+
+    def cancel(rng):
+        # Cancels bookings made by the book operation, so it must run after it
+        try:
+            booking_id, user_id = booked.popleft()
+        except IndexError:
+            return
+        service.cancel_booking(booking_id, user_id)
+
+    return {
+        "search_flights": lambda rng: service.search_flights(*rng.choice(params["flights"])),
+        "search_routes": lambda rng: routes.search_routes(*rng.choice(params["flights"])),
+        "search_hotels": lambda rng: service.search_hotels(*rng.choice(params["hotels"])),
+        "search_cars": lambda rng: service.search_cars(*rng.choice(params["cars"])),
+        "login_user": login,
+        "get_total_price": lambda rng: service.get_total_price(*reversed(itinerary(rng))),
+        "book": book,
+        "modify_booking": modify,
+        "cancel_booking": cancel,
+    }
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, round(fraction * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def run_operation(operation, workers, iterations, seed=3):
+    # Each worker makes `iterations` calls; returns per-call latencies and wall time
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+    start_barrier = threading.Barrier(workers + 1)
+
+    def worker(index):
+        rng = random.Random(seed * 1000 + index)
+        local = []
+        start_barrier.wait()
+        for _ in range(iterations):
+            start = time.perf_counter()
+            try:
+                operation(rng)
+            except Exception as e:
+                with lock:
+                    errors.append(f"{type(e).__name__}: {e}")
+                continue
+            local.append(time.perf_counter() - start)
+        with lock:
+            latencies.extend(local)
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(workers)]
+    for thread in threads:
+        thread.start()
+    start_barrier.wait()
+    wall_start = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    return latencies, time.perf_counter() - wall_start, errors
+
+
+def summarize(latencies, wall, errors):
+    latencies = sorted(latencies)
+    ms = lambda seconds: round(seconds * 1000, 4)
+    return {
+        "calls": len(latencies),
+        "errors": len(errors),
+        "error_samples": errors[:3],
+        "throughput_ops": round(len(latencies) / wall, 2) if wall else 0.0,
+        "mean_ms": ms(statistics.fmean(latencies)) if latencies else 0.0,
+        "p50_ms": ms(percentile(latencies, 0.50)),
+        "p95_ms": ms(percentile(latencies, 0.95)),
+        "p99_ms": ms(percentile(latencies, 0.99)),
+        "max_ms": ms(latencies[-1]) if latencies else 0.0,
+    }
+
+
+def startup_benchmark(path, runs=5):
+    # Cold start of the Streamlit app: import time, the first render of the login
+    # page and one rerun, as medians over `runs` fresh processes
+    app = os.path.join(os.path.dirname(os.path.abspath(__file__)), "server.py")
+    env = dict(os.environ, TRAVEL_BOOKING_DB=os.path.abspath(path), TRAVEL_BOOKING_NOTIFICATION_LOG=os.devnull,
+               TRAVEL_BOOKING_SEARCH_ENGINE=columnar.ENGINE, TRAVEL_BOOKING_SHARDS=str(shards.SHARDS))
+    samples = []
+    for _ in range(runs):
+        output = subprocess.run([sys.executable, "-c", STARTUP_PROBE, app, *HEAVY_MODULES],
+                                env=env, cwd=os.path.dirname(app), capture_output=True, text=True, check=True).stdout
+        sample = json.loads(output.strip().splitlines()[-1])
+        if sample["error"]:
+            raise RuntimeError(f"server.py failed to render: {sample['error']}")
+        samples.append(sample)
+    result = {name: round(statistics.median(sample[name] for sample in samples), 1)
+              for name in ("import_streamlit_ms", "import_app_ms", "first_render_ms", "rerun_ms")}
+    result["runs"] = runs
+    result["loaded_at_first_render"] = samples[-1]["loaded"]
+    print(f"startup  import streamlit={result['import_streamlit_ms']:.1f}ms app={result['import_app_ms']:.1f}ms "
+          f"first render={result['first_render_ms']:.1f}ms rerun={result['rerun_ms']:.1f}ms "
+          f"loaded={','.join(result['loaded_at_first_render']) or 'none'}", file=sys.stderr)
+    return result
+
+
+def run_benchmark(path, worker_counts, iterations, operations=None, use_cache=False):
+    db.configure(path, max_size=max(worker_counts))
+    if not use_cache:
+        # A zero TTL turns every cache lookup into a miss, so the database path is measured
+        cache.lookups.ttl = 0
+        cache.searches.ttl = 0
+    ops = make_operations(sample_params(path, shard_count=shards.SHARDS))
+    # Build the route graph and any columnar snapshot up front so their one-off
+    # loads are not timed as searches
+    routes.graph.refresh()
+    if columnar.enabled():
+        columnar.warm()
+    selected = operations or list(ops)
+    results = []
+    for workers in worker_counts:
+        for name in selected:
+            latencies, wall, errors = run_operation(ops[name], workers, iterations)
+            result = {"operation": name, "workers": workers, "iterations_per_worker": iterations}
+            result.update(summarize(latencies, wall, errors))
+            results.append(result)
+            print(f"{name:<16} workers={workers:<3} {result['throughput_ops']:>10.1f} ops/s  "
+                  f"p50={result['p50_ms']:.3f}ms p95={result['p95_ms']:.3f}ms p99={result['p99_ms']:.3f}ms"
+                  f"{'  errors=' + str(result['errors']) if result['errors'] else ''}", file=sys.stderr)
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the booking service against a synthetic inventory.")
+    parser.add_argument("--db", default="benchmark.db", help="database file to generate and benchmark (default: %(default)s)")
+    parser.add_argument("--reuse", action="store_true", help="benchmark an existing --db instead of generating one")
+    parser.add_argument("--flights", type=int, default=100000)
+    parser.add_argument("--hotels", type=int, default=20000)
+    parser.add_argument("--cars", type=int, default=20000)
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--bookings", type=int, default=5000)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--workers", default="1,8", help="comma separated worker counts (default: %(default)s)")
+    parser.add_argument("--iterations", type=int, default=500, help="calls per worker per operation (default: %(default)s)")
+    parser.add_argument("--operations", help="comma separated subset of operations to run")
+    parser.add_argument("--cache", action="store_true", help="leave the in-process caches enabled")
+    parser.add_argument("--engine", choices=columnar.ENGINES, default="sql",
+                        help="search engine for the search_* operations (default: %(default)s)")
+    parser.add_argument("--scrypt-n", type=int, default=passwords.SCRYPT_N,
+                        help="scrypt cost for generated users and login rehashes (default: %(default)s)")
+    parser.add_argument("--group-commit", action="store_true", help="batch concurrent booking writes into shared commits")
+    parser.add_argument("--shards", type=int, default=0,
+                        help="split users and bookings over this many shard files before running (default: %(default)s)")
+    parser.add_argument("--startup", type=int, metavar="RUNS",
+                        help="measure the Streamlit app's cold start over RUNS fresh processes instead of the operations")
+    parser.add_argument("--output", help="write the JSON report here instead of stdout")
+    args = parser.parse_args()
+
+    sizes = {"flights": args.flights, "hotels": args.hotels, "cars": args.cars, "users": args.users, "bookings": args.bookings}
+    passwords.configure(args.scrypt_n)
+    if not args.reuse:
+        start = time.perf_counter()
+        generate(args.db, seed=args.seed, **sizes)
+        print(f"Generated {args.db} in {time.perf_counter() - start:.1f}s", file=sys.stderr)
+    if args.shards:
+        # Moves whatever is in the catalog, so a reused, already split database is left alone
+        start = time.perf_counter()
+        shards.rebalance(args.db, 0, args.shards)
+        print(f"Split into {args.shards} shards in {time.perf_counter() - start:.1f}s", file=sys.stderr)
+
+    worker_counts = [int(count) for count in args.workers.split(",")]
+    columnar.configure(args.engine)
+    bookings.configure(args.group_commit)
+    shards.configure(args.shards)
+    operations = args.operations.split(",") if args.operations else None
+    report = {
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "platform": platform.platform(),
+        "database": args.db,
+        "dataset": None if args.reuse else dict(sizes, seed=args.seed),
+        "cache_enabled": args.cache,
+        "search_engine": args.engine,
+        "scrypt_n": args.scrypt_n,
+        "group_commit": args.group_commit,
+        "shards": args.shards,
+    }
+    if args.startup:
+        report["startup"] = startup_benchmark(args.db, args.startup)
+    else:
+        report["results"] = run_benchmark(args.db, worker_counts, args.iterations, operations, args.cache)
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
@@ -0,0 +1,60 @@
+import threading
+
+import db
+
+BLOCK_SIZE = 100
+PREFIX = "B"
+
+
+class BookingIdAllocator:
+    # Hands out booking IDs from a block of sequence values reserved in one short
+    # write. Reservations are atomic, so processes never share a value; unused values
+    # in a block are simply skipped when the process exits.
+    def __init__(self, block_size=BLOCK_SIZE):
+        self.block_size = block_size
+        self._lock = threading.Lock()
+        self._next = 0
+        self._end = 0
+        self._path = None
+
+    def _reserve(self):
+        pool = db.get_pool()
+        with pool.connection() as conn:
+            end = conn.execute(
+                "UPDATE BookingSequence SET NextValue = NextValue + ? WHERE Name = 'Booking' RETURNING NextValue",
+                (self.block_size,)
+            ).fetchall()[0][0]
+        self._next = end - self.block_size
+        self._end = end
+        self._path = pool.path
+
+    def next_id(self):
+        with self._lock:
+            if self._next >= self._end or self._path != db.get_pool().path:
+                self._reserve()
+            value = self._next
+            self._next += 1
+        return f"{PREFIX}{value}"
+
+
+allocator = BookingIdAllocator()
+
+
+def advance_sequence(conn):
+    # Moves the sequences past every numeric ID in Booking and every UserID in Users,
+    # for writers that insert IDs of their own (seed data, bulk loads) instead of
+    # taking them from the allocator or the user directory
+    conn.execute(f'''
+        UPDATE BookingSequence SET NextValue = MAX(NextValue, (
+            SELECT COALESCE(MAX(CAST(SUBSTR(BookingID, {len(PREFIX) + 1}) AS INTEGER)), 0) + 1
+            FROM Booking WHERE BookingID LIKE '{PREFIX}%'
+        )) WHERE Name = 'Booking'
+    ''')
+    conn.execute('''
+        UPDATE BookingSequence SET NextValue = MAX(NextValue, (SELECT COALESCE(MAX(UserID), 0) + 1 FROM Users))
+        WHERE Name = 'User'
+    ''')
+
+
+def next_booking_id():
+    return allocator.next_id()
@@ -0,0 +1,369 @@
+import os
+import queue
+import random
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future
+from datetime import datetime
+
+import availability
+import booking_ids
+import cache
+import db
+import notifications
+import pricing
+import shards
+
+PAYMENT_METHOD = "Credit Card"
+# A write that finds the database locked starts over, up to MAX_ATTEMPTS times,
+# sleeping a jittered BACKOFF_BASE * 2**attempt (at most BACKOFF_MAX) in between
+MAX_ATTEMPTS = 6
+BACKOFF_BASE = 0.01
+BACKOFF_MAX = 0.5
+# Group commit: up to BATCH_SIZE queued writes share one transaction and one
+# commit. Writes arriving while a batch commits form the next one; BATCH_WAIT
+# optionally holds a batch open that many seconds for more to arrive.
+GROUP_COMMIT = os.environ.get('TRAVEL_BOOKING_GROUP_COMMIT', '') == '1'
+BATCH_SIZE = 64
+BATCH_WAIT = 0.0
+# Seconds between passes settling the sharded capacity journal
+RECONCILE_INTERVAL = 5.0
+# Tables a booking write changes that searches are cached from
+CAPACITY_TABLES = tuple(inventory.availability for inventory in availability.KINDS.values())
+
+
+class BookingNotFound(LookupError):
+    pass
+
+
+def configure(group_commit):
+    global GROUP_COMMIT
+    GROUP_COMMIT = group_commit
+
+
+_stats_lock = threading.Lock()
+_stats = {"transactions": 0, "busy_retries": 0, "batches": 0, "batched_writes": 0}
+
+
+def _count(name, amount=1):
+    with _stats_lock:
+        _stats[name] += amount
+
+
+def is_busy(error):
+    name = getattr(error, "sqlite_errorname", "") or ""
+    message = str(error)
+    return name.startswith(("SQLITE_BUSY", "SQLITE_LOCKED")) or "locked" in message or "busy" in message
+
+
+def run_transaction(work, *args, pool=None):
+    # Runs work(conn, *args) in a BEGIN IMMEDIATE transaction on pool (the catalog
+    # database by default). Taking the write lock up front means reads inside work
+    # see the data the writes are based on, and a busy database fails at BEGIN,
+    # before anything is done, so it is safe to retry.
+    pool = pool or db.get_pool()
+    for attempt in range(MAX_ATTEMPTS):
+        try:
+            with pool.connection() as conn:
+                if conn.in_transaction:
+                    # Called from inside another transaction: that one owns the commit
+                    return work(conn, *args)
+                conn.execute("BEGIN IMMEDIATE")
+                result = work(conn, *args)
+            _count("transactions")
+            return result
+        except sqlite3.OperationalError as e:
+            if not is_busy(e) or attempt == MAX_ATTEMPTS - 1:
+                raise
+            _count("busy_retries")
+            time.sleep(min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt) * random.uniform(0.5, 1.0))
+
+
+class GroupCommitter:
+    # Callers queue their writes and wait; one thread runs each batch in a single
+    # transaction. Every write gets its own savepoint, so one that fails (sold out,
+    # unknown booking) is undone alone and the rest still commit together.
+    def __init__(self, batch_size=BATCH_SIZE, max_wait=BATCH_WAIT, pool=None):
+        self.pool = pool
+        self.batch_size = batch_size
+        self.max_wait = max_wait
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def submit(self, work, *args):
+        future = Future()
+        self._queue.put((work, args, future))
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="group-commit", daemon=True)
+                self._thread.start()
+        return future.result()
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                try:
+                    batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            self._commit(batch)
+
+    def _commit(self, batch):
+        outcomes = []
+
+        def work(conn):
+            outcomes.clear()
+            for job, args, _ in batch:
+                conn.execute("SAVEPOINT booking_write")
+                try:
+                    outcomes.append((True, job(conn, *args)))
+                except Exception as e:
+                    conn.execute("ROLLBACK TO booking_write")
+                    outcomes.append((False, e))
+                conn.execute("RELEASE booking_write")
+
+        try:
+            run_transaction(work, pool=self.pool)
+        except BaseException as e:
+            for _, _, future in batch:
+                future.set_exception(e)
+            return
+        _count("batches")
+        _count("batched_writes", len(batch))
+        # Only now are the writes durable, so only now are the callers told
+        for (ok, value), (_, _, future) in zip(outcomes, batch):
+            if ok:
+                future.set_result(value)
+            else:
+                future.set_exception(value)
+
+
+committer = GroupCommitter()
+# One committer per shard file when sharded, each with its own writer thread
+_shard_committers = {}
+_committers_lock = threading.Lock()
+
+
+def _committer(pool):
+    if not shards.enabled():
+        return committer
+    with _committers_lock:
+        current = _shard_committers.get(pool.path)
+        if current is None or current.pool is not pool:
+            current = _shard_committers[pool.path] = GroupCommitter(pool=pool)
+        return current
+
+
+def _submit(user_id, work, *args):
+    # The write runs against the database holding the user's rows
+    pool = shards.pool_for(user_id)
+    return _committer(pool).submit(work, *args) if GROUP_COMMIT else run_transaction(work, *args, pool=pool)
+
+
+def _committed(result):
+    # Runs once a write has committed, outside anything that would undo it. Have the
+    # dispatcher pick up the write's notifications now.
+    notifications.wake()
+    try:
+        # And this process's searches see the new capacity at once
+        cache.invalidate_catalog(CAPACITY_TABLES)
+    except (sqlite3.Error, db.PoolTimeout):
+        # They see it on the next version poll instead
+        pass
+    return result
+
+
+def _now():
+    now = datetime.now()
+    return now.strftime('%Y-%m-%d'), now.strftime('%H:%M:%S')
+
+
+def _payment_method(conn, booking_id):
+    # Adjustments and refunds go back the way the booking was paid
+    row = conn.execute("SELECT PaymentMethod FROM Payment WHERE BookingID = ? ORDER BY PaymentID LIMIT 1",
+                       (booking_id,)).fetchone()
+    return row[0] if row else PAYMENT_METHOD
+
+
+def _record(conn, user_id, booking_id, amount, payment_method, kind, message):
+    today, now = _now()
+    notifications.enqueue(conn, user_id, booking_id, kind, message)
+    if amount:
+        conn.execute('''
+            INSERT INTO Payment (UserID, BookingID, Amount, PaymentMethod, TransactionDate, TransactionTime)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', (user_id, booking_id, round(amount, 2), payment_method, today, now))
+        notifications.enqueue(conn, user_id, booking_id, "Payment",
+                              f"{'Payment' if amount > 0 else 'Refund'} of ${abs(amount):.2f} for booking {booking_id}"
+                              f" {'received' if amount > 0 else 'issued'} ({payment_method}).")
+
+
+def _reserve(conn, booking_id, booking_quote, stay, rental, release=False):
+    # stay is (check-in, check-out) and rental (pickup, drop); without them the
+    # booking takes the first listing that is free for all of its own dates.
+    # Returns the quote priced from the listings taken.
+    if release:
+        availability.release(conn, booking_id)
+    hotel_row = availability.reserve(conn, booking_id, "hotel", booking_quote.hotel_id,
+                                     availability.hotel_days(*stay) if stay else None)
+    car_row = availability.reserve(conn, booking_id, "car", booking_quote.car_id,
+                                   availability.car_days(*rental) if rental else None)
+    return pricing.priced_listings(conn, booking_quote, hotel_row, car_row)
+
+
+def _journaled(conn, booking_id, user_id, change, *args):
+    # Runs a capacity change in the catalog. Unsharded it joins the booking write's
+    # transaction. Sharded it commits first, on its own, so it is journaled here with
+    # what the booking held before; returns (change ID or None, change's result).
+    if not shards.enabled():
+        return None, change(conn, *args)
+    held = availability.holdings(conn, booking_id)
+    result = change(conn, *args)
+    return availability.journal(conn, booking_id, user_id, held), result
+
+
+def _change_capacity(conn, booking_id, user_id, undo, change, *args):
+    # Called from the shard write. Its marker commits with the shard's rows, so
+    # whoever settles the change can tell whether they did.
+    change_id, result = run_transaction(_journaled, booking_id, user_id, change, *args)
+    if change_id is not None:
+        undo.append(change_id)
+        conn.execute("INSERT INTO AppliedCapacity (ChangeID) VALUES (?)", (change_id,))
+    return result
+
+
+def _book(conn, booking_id, user_id, flight_name, hotel_name, car_name, stay, rental, payment_method, undo):
+    # Capacity is taken first, as TotalAmt is priced from the listings it lands on;
+    # a sold-out listing fails before any rows are written
+    booking_quote = _change_capacity(conn, booking_id, user_id, undo, _reserve, booking_id,
+                                     pricing.quote_sql(flight_name, hotel_name, car_name), stay, rental)
+    conn.execute('''
+        INSERT INTO Booking (BookingID, UserID, FlightID, HotelID, CarID, BookingDate, TotalAmt)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    ''', (booking_id, user_id, booking_quote.flight_id, booking_quote.hotel_id, booking_quote.car_id,
+          _now()[0], booking_quote.total))
+    _record(conn, user_id, booking_id, booking_quote.total, payment_method, "Booking",
+            f"Your booking {booking_id} is confirmed.")
+    return booking_quote
+
+
+def _modify(conn, booking_id, user_id, flight_name, hotel_name, car_name, stay, rental, undo):
+    booking_quote = pricing.quote_sql(flight_name, hotel_name, car_name)
+    row = conn.execute("SELECT TotalAmt FROM Booking WHERE BookingID = ? AND UserID = ?", (booking_id, user_id)).fetchone()
+    if row is None:
+        raise BookingNotFound(booking_id)
+    booking_quote = _change_capacity(conn, booking_id, user_id, undo, _reserve, booking_id, booking_quote, stay, rental,
+                                     True)
+    conn.execute('''
+        UPDATE Booking
+        SET FlightID = ?, HotelID = ?, CarID = ?, TotalAmt = ?
+        WHERE BookingID = ? AND UserID = ?
+    ''', (booking_quote.flight_id, booking_quote.hotel_id, booking_quote.car_id, booking_quote.total, booking_id, user_id))
+    # The payment row carries the difference: positive is charged, negative refunded
+    _record(conn, user_id, booking_id, booking_quote.total - row[0], _payment_method(conn, booking_id), "Booking",
+            f"Your booking {booking_id} has been changed.")
+    return booking_quote
+
+
+def _cancel(conn, booking_id, user_id, undo):
+    row = conn.execute("DELETE FROM Booking WHERE BookingID = ? AND UserID = ? RETURNING TotalAmt",
+                       (booking_id, user_id)).fetchone()
+    if row is None:
+        return False
+    _record(conn, user_id, booking_id, -row[0], _payment_method(conn, booking_id), "Cancellation",
+            f"Your booking {booking_id} has been canceled.")
+    _change_capacity(conn, booking_id, user_id, undo, availability.release, booking_id)
+    return True
+
+
+def _settle(conn, change_ids):
+    # Settles journaled capacity changes of the shard conn belongs to. The caller holds
+    # that shard's write lock, so no write to it is in flight: a change whose marker
+    # is not there now never committed, and is undone.
+    if not change_ids:
+        return 0
+    marks = ", ".join("?" * len(change_ids))
+    applied = {row[0] for row in conn.execute(f"SELECT ChangeID FROM AppliedCapacity WHERE ChangeID IN ({marks})",
+                                              change_ids)}
+    undone = run_transaction(availability.settle, change_ids, applied)
+    conn.execute(f"DELETE FROM AppliedCapacity WHERE ChangeID IN ({marks})", change_ids)
+    return undone
+
+
+def _undoable(user_id, work, *args):
+    # Runs a booking write. When sharded and the shard write fails after its capacity
+    # change committed in the catalog, that change is undone.
+    undo = []
+    try:
+        result = _submit(user_id, work, *args, undo)
+    except BaseException:
+        if undo:
+            run_transaction(_settle, undo, pool=shards.pool_for(user_id))
+        raise
+    return _committed(result)
+
+
+def reconcile():
+    # Settles every journaled capacity change, such as those left by a process that
+    # died between the catalog and the shard commit. Returns how many were undone.
+    if not shards.enabled():
+        return 0
+    with db.connection() as conn:
+        pending = conn.execute("SELECT ChangeID, UserID FROM CapacityJournal").fetchall()
+    undone = 0
+    for pool in shards.pools():
+        change_ids = [change_id for change_id, user_id in pending if shards.pool_for(user_id) is pool]
+        undone += run_transaction(_settle, change_ids, pool=pool)
+    return undone
+
+
+def _reconcile_forever(interval):
+    while True:
+        try:
+            reconcile()
+        except Exception:
+            # Database trouble: try again next time
+            pass
+        time.sleep(interval)
+
+
+_reconciler = None
+
+
+def start_reconciler(interval=RECONCILE_INTERVAL):
+    # Settles the journal in the background: at once, for anything a crash left, and
+    # then every interval seconds, so it stays small
+    global _reconciler
+    if _reconciler is None:
+        _reconciler = threading.Thread(target=_reconcile_forever, args=(interval,), name="reconcile", daemon=True)
+        _reconciler.start()
+    return _reconciler
+
+
+def book(user_id, flight_name, hotel_name, car_name, stay=None, rental=None, payment_method=PAYMENT_METHOD):
+    # The ID comes from its own short write first: a block reserved inside a
+    # transaction that is then rolled back would be handed out twice
+    booking_id = booking_ids.next_booking_id()
+    return booking_id, _undoable(user_id, _book, booking_id, user_id, flight_name, hotel_name, car_name, stay,
+                                 rental, payment_method)
+
+
+def modify(booking_id, user_id, flight_name, hotel_name, car_name, stay=None, rental=None):
+    return _undoable(user_id, _modify, booking_id, user_id, flight_name, hotel_name, car_name, stay, rental)
+
+
+def cancel(booking_id, user_id):
+    return _undoable(user_id, _cancel, booking_id, user_id)
+
+
+def stats():
+    with _stats_lock:
+        stats = dict(_stats)
+    stats["group_commit"] = GROUP_COMMIT
+    stats["avg_batch_size"] = stats["batched_writes"] / stats["batches"] if stats["batches"] else 0.0
+    return stats
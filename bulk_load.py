@@ -0,0 +1,176 @@
+import argparse
+import csv
+import json
+import os
+import sqlite3
+import time
+from itertools import islice
+
+import availability
+import booking_ids
+import cache
+import create
+import migrations
+import reports
+
+BATCH_SIZE = 50000
+
+# Durability is traded for speed only for the duration of a load; the previous
+# settings are restored afterwards
+LOAD_PRAGMAS = [
+    "PRAGMA synchronous = OFF",
+    "PRAGMA cache_size = -262144",
+    "PRAGMA temp_store = MEMORY",
+]
+
+
+def table_columns(conn, table):
+    columns = [row[1] for row in conn.execute(f"PRAGMA table_info({table})")]
+    if not columns:
+        raise ValueError(f"Unknown table: {table}")
+    return columns
+
+
+def read_rows(path):
+    # Yields (columns, row) lazily so files larger than memory stream straight through
+    if path.endswith(".jsonl") or path.endswith(".ndjson"):
+        with open(path, encoding="utf-8") as f:
+            columns = None
+            for line in f:
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                if columns is None:
+                    columns = list(record)
+                yield columns, tuple(record.get(column) for column in columns)
+    else:
+        with open(path, newline="", encoding="utf-8") as f:
+            reader = csv.reader(f)
+            columns = next(reader)
+            for row in reader:
+                yield columns, tuple(value if value != "" else None for value in row)
+
+
+def drop_schema_objects(conn, table, kind):
+    # Drops the table's indexes or triggers and returns their SQL for re-creation
+    objects = conn.execute(
+        "SELECT name, sql FROM sqlite_master WHERE type = ? AND tbl_name = ? AND sql IS NOT NULL", (kind, table)
+    ).fetchall()
+    for name, _ in objects:
+        conn.execute(f"DROP {kind.upper()} {name}")
+    return [sql for _, sql in objects]
+
+
+def load_table(conn, table, path, batch_size=BATCH_SIZE):
+    allowed = set(table_columns(conn, table))
+    rows = read_rows(path)
+    first = next(rows, None)
+    if first is None:
+        return 0
+    columns, _ = first
+    unknown = [column for column in columns if column not in allowed]
+    if unknown:
+        raise ValueError(f"{path}: columns {unknown} do not exist in {table}")
+
+    sql = f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})"
+    loaded = 0
+    batch = [first[1]]
+    batch.extend(row for _, row in islice(rows, batch_size - 1))
+    while batch:
+        conn.executemany(sql, batch)
+        loaded += len(batch)
+        batch = [row for _, row in islice(rows, batch_size)]
+    return loaded
+
+
+def bulk_load(path, sources, batch_size=BATCH_SIZE, defer_indexes=True):
+    # sources is a list of (table, file) pairs; returns per-table (rows, seconds)
+    conn = sqlite3.connect(path, isolation_level=None)
+    migrations.migrate(conn)
+    previous = {
+        "synchronous": conn.execute("PRAGMA synchronous").fetchone()[0],
+        "journal_mode": conn.execute("PRAGMA journal_mode").fetchone()[0],
+        "wal_autocheckpoint": conn.execute("PRAGMA wal_autocheckpoint").fetchone()[0],
+    }
+    for pragma in LOAD_PRAGMAS:
+        conn.execute(pragma)
+    if previous["journal_mode"] == "wal":
+        # Leaving WAL needs exclusive access, which the running app would block.
+        # Skip the periodic checkpoints instead and checkpoint once at the end.
+        conn.execute("PRAGMA wal_autocheckpoint = 0")
+    else:
+        conn.execute("PRAGMA journal_mode = MEMORY")
+
+    report = []
+    try:
+        for table, source in sources:
+            start = time.perf_counter()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                deferred = drop_schema_objects(conn, table, "index") if defer_indexes else []
+                # Change-counter triggers would fire once per row; bump the counter once instead
+                triggers = drop_schema_objects(conn, table, "trigger")
+                rows = load_table(conn, table, source, batch_size)
+                # Building each index once over the loaded rows is far cheaper than
+                # maintaining it row by row during the insert
+                for sql in deferred + triggers:
+                    conn.execute(sql)
+                if table in migrations.CATALOG_TABLES:
+                    cache.bump_version(conn, table)
+                if table in ("Booking", "Users"):
+                    booking_ids.advance_sequence(conn)
+                if table in ("Booking", "Payment"):
+                    # The report triggers were dropped with the rest, so recount in one pass
+                    reports.rebuild(conn)
+                for kind, inventory in availability.KINDS.items():
+                    if inventory.table == table:
+                        # New listings need their per-day capacity rows, again without per-row triggers
+                        availability_triggers = drop_schema_objects(conn, inventory.availability, "trigger")
+                        availability.populate(conn, kind)
+                        for sql in availability_triggers:
+                            conn.execute(sql)
+                        cache.bump_version(conn, inventory.availability)
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            report.append((table, source, rows, time.perf_counter() - start))
+        conn.execute("ANALYZE")
+    finally:
+        if previous["journal_mode"] == "wal":
+            conn.execute(f"PRAGMA wal_autocheckpoint = {previous['wal_autocheckpoint']}")
+            conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        else:
+            conn.execute(f"PRAGMA journal_mode = {previous['journal_mode']}")
+        conn.execute(f"PRAGMA synchronous = {previous['synchronous']}")
+        conn.close()
+    return report
+
+
+def parse_source(value):
+    table, sep, source = value.partition("=")
+    if not sep or not table or not source:
+        raise argparse.ArgumentTypeError(f"Expected TABLE=FILE, got {value!r}")
+    if not os.path.exists(source):
+        raise argparse.ArgumentTypeError(f"No such file: {source}")
+    return table, source
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Bulk import CSV/JSONL inventory files into the travel booking database.")
+    parser.add_argument("sources", nargs="+", type=parse_source, metavar="TABLE=FILE",
+                        help="table name and a .csv (with header) or .jsonl file, e.g. Flights=flights.csv")
+    parser.add_argument("--db", default=create.DB_PATH, help="database file (default: %(default)s)")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE, help="rows per executemany call (default: %(default)s)")
+    parser.add_argument("--keep-indexes", action="store_true", help="maintain indexes during the load instead of rebuilding them afterwards")
+    args = parser.parse_args()
+
+    total_rows = 0
+    total_seconds = 0.0
+    for table, source, rows, seconds in bulk_load(args.db, args.sources, args.batch_size, not args.keep_indexes):
+        rate = rows / seconds if seconds else 0
+        print(f"{table}: {rows} rows from {source} in {seconds:.2f}s ({rate:,.0f} rows/s)")
+        total_rows += rows
+        total_seconds += seconds
+    if total_seconds:
+        print(f"Total: {total_rows} rows in {total_seconds:.2f}s ({total_rows / total_seconds:,.0f} rows/s)")
@@ -0,0 +1,175 @@
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+import db
+from migrations import CATALOG_TABLES
+
+LOOKUP_TTL = 300.0
+SEARCH_TTL = 60.0
+SEARCH_MAX_BYTES = 64 * 1024 * 1024
+# How often the CatalogVersion counters are re-read. Writes made by other processes
+# (e.g. bulk_load.py) become visible to the caches within this many seconds.
+VERSION_POLL_INTERVAL = 1.0
+
+
+def read_versions(conn):
+    return {row[0]: row[1] for row in conn.execute("SELECT TableName, Version FROM CatalogVersion")}
+
+
+def bump_version(conn, table):
+    conn.execute("UPDATE CatalogVersion SET Version = Version + 1 WHERE TableName = ?", (table,))
+
+
+class CatalogVersions:
+    def __init__(self, poll_interval=VERSION_POLL_INTERVAL):
+        self.poll_interval = poll_interval
+        self._lock = threading.Lock()
+        self._versions = {}
+        self._checked = None
+
+    def current(self, tables):
+        now = time.monotonic()
+        with self._lock:
+            stale = self._checked is None or now - self._checked >= self.poll_interval
+        if stale:
+            self.refresh()
+        with self._lock:
+            return tuple(self._versions.get(table, 0) for table in tables)
+
+    def refresh(self):
+        with db.connection() as conn:
+            versions = read_versions(conn)
+        with self._lock:
+            self._versions = versions
+            self._checked = time.monotonic()
+
+
+class TTLCache:
+    def __init__(self, ttl=LOOKUP_TTL, versions=None):
+        self.ttl = ttl
+        self.versions = versions
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._stats = {"hits": 0, "misses": 0, "expired": 0, "stale": 0, "invalidations": 0}
+
+    def get(self, key, tables, loader):
+        # Entries are reused until their TTL runs out or any table they were read
+        # from has been written to since
+        versions = self.versions.current(tables) if self.versions else ()
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, expires, entry_versions, _ = entry
+                if now < expires and entry_versions == versions:
+                    self._stats["hits"] += 1
+                    self._touch(key)
+                    return value
+                self._stats["expired" if now >= expires else "stale"] += 1
+                self._remove(key)
+            self._stats["misses"] += 1
+
+        value = loader()
+        with self._lock:
+            self._store(key, (value, now + self.ttl, versions, tuple(tables)))
+        return value
+
+    def _touch(self, key):
+        pass
+
+    def _store(self, key, entry):
+        self._entries[key] = entry
+
+    def _remove(self, key):
+        del self._entries[key]
+
+    def invalidate(self, tables=None):
+        # Drops every entry read from any of the given tables, or everything
+        with self._lock:
+            if tables is None:
+                dropped = list(self._entries)
+            else:
+                dropped = [key for key, entry in self._entries.items() if set(entry[3]) & set(tables)]
+            for key in dropped:
+                self._remove(key)
+            self._stats["invalidations"] += len(dropped)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["entries"] = len(self._entries)
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_ratio"] = stats["hits"] / lookups if lookups else 0.0
+        return stats
+
+
+def estimate_size(value):
+    # Rough in-memory footprint of a result set: the containers plus every field
+    if isinstance(value, (list, tuple)):
+        return sys.getsizeof(value) + sum(estimate_size(item) for item in value)
+    return sys.getsizeof(value)
+
+
+class LRUCache(TTLCache):
+    # TTLCache bounded by the estimated bytes of its values, evicting least recently used first
+    def __init__(self, ttl=SEARCH_TTL, versions=None, max_bytes=SEARCH_MAX_BYTES, max_entries=None):
+        super().__init__(ttl, versions)
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self._sizes = {}
+        self._bytes = 0
+        self._stats["evictions"] = 0
+        self._stats["too_large"] = 0
+
+    def _touch(self, key):
+        self._entries.move_to_end(key)
+
+    def _store(self, key, entry):
+        size = estimate_size(entry[0])
+        if size > self.max_bytes:
+            self._stats["too_large"] += 1
+            return
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = entry
+        self._sizes[key] = size
+        self._bytes += size
+        while self._bytes > self.max_bytes or (self.max_entries and len(self._entries) > self.max_entries):
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+            self._stats["evictions"] += 1
+
+    def _remove(self, key):
+        del self._entries[key]
+        self._bytes -= self._sizes.pop(key)
+
+    def stats(self):
+        stats = super().stats()
+        with self._lock:
+            stats["bytes"] = self._bytes
+        stats["max_bytes"] = self.max_bytes
+        return stats
+
+
+catalog_versions = CatalogVersions()
+lookups = TTLCache(LOOKUP_TTL, catalog_versions)
+searches = LRUCache(SEARCH_TTL, catalog_versions, SEARCH_MAX_BYTES)
+
+
+def cached_search(name, tables, params, loader):
+    # Rows are stored as plain tuples so they can be shared across sessions and sized
+    return searches.get((name,) + tuple(params), tables, lambda: [tuple(row) for row in loader(*params)])
+
+
+def invalidate_catalog(tables=CATALOG_TABLES):
+    # Call after writing catalog rows in this process so the change is seen at once
+    # rather than on the next version poll
+    lookups.invalidate(tables)
+    searches.invalidate(tables)
+    catalog_versions.refresh()
+
+
+def cache_stats():
+    return {"lookups": lookups.stats(), "searches": searches.stats()}
@@ -0,0 +1,359 @@
+import os
+import random
+import sqlite3
+import sys
+import threading
+import time
+
+import availability
+import cache
+import db
+
+# Optional: without NumPy every search goes to SQLite. Imported on first use of
+# the columnar engine, so processes on the default SQL engine start without it.
+np = None
+_numpy_missing = False
+
+ENGINES = ("sql", "columnar")
+ENGINE = os.environ.get('TRAVEL_BOOKING_SEARCH_ENGINE', 'sql')
+
+
+def _numpy():
+    global np, _numpy_missing
+    if np is None and not _numpy_missing:
+        try:
+            import numpy
+        except ImportError:
+            _numpy_missing = True
+        else:
+            np = numpy
+    return np
+
+
+def configure(engine):
+    global ENGINE
+    if engine not in ENGINES:
+        raise ValueError(f"engine must be one of: {', '.join(ENGINES)}")
+    if engine == "columnar" and _numpy() is None:
+        raise RuntimeError("the columnar search engine needs numpy")
+    ENGINE = engine
+
+
+def enabled():
+    return ENGINE == "columnar" and _numpy() is not None
+
+
+class Column:
+    # Dictionary-encoded text: each distinct value is stored once and rows hold
+    # int32 codes, so equality filters compare integers
+    def __init__(self, values):
+        codes = {}
+        self.codes = np.fromiter((codes.setdefault(value, len(codes)) for value in values), dtype=np.int32, count=len(values))
+        self.values = list(codes)
+        self._codes = codes
+
+    def code(self, value):
+        return self._codes.get(value, -1)
+
+    def take(self, rows):
+        values = self.values
+        return [values[code] for code in self.codes[rows].tolist()]
+
+    @property
+    def nbytes(self):
+        return self.codes.nbytes + sum(map(sys.getsizeof, self.values))
+
+
+class Numbers:
+    def __init__(self, values, dtype="float64"):
+        self.array = np.array(values, dtype=dtype)
+
+    def take(self, rows):
+        return self.array[rows].tolist()
+
+    @property
+    def nbytes(self):
+        return self.array.nbytes
+
+
+def _day_numbers(column):
+    # Integer dates for a dictionary-encoded date column, parsing each distinct date once
+    days = np.array([availability.day_number(value) for value in column.values], dtype=np.int32)
+    return days[column.codes]
+
+
+def _sorted_index(keys):
+    # (sorted keys, row numbers in that order): rows sharing a key form one
+    # contiguous run that two binary searches find
+    order = np.argsort(keys, kind="stable")
+    return keys[order], order
+
+
+def _lookup(index, key):
+    keys, order = index
+    rows = order[np.searchsorted(keys, key, side="left"):np.searchsorted(keys, key, side="right")]
+    # Back to rowid order, as the SQL path returns them
+    return np.sort(rows)
+
+
+def _load(conn, sql, columns):
+    # {name: Column or Numbers} plus the rowids, in rowid order
+    rows = conn.execute(sql).fetchall()
+    fields = list(zip(*rows)) if rows else [()] * (len(columns) + 1)
+    table = {"rowid": np.array(fields[0], dtype=np.int64)}
+    for (name, kind), values in zip(columns, fields[1:]):
+        table[name] = Column(values) if kind == "text" else Numbers(values)
+    return table
+
+
+def load_flights(conn):
+    table = _load(conn, '''
+        SELECT Flights.rowid, FlightNo, Airline, DeptAirport, ArrivalAirport, DeptDate, DeptTime, ArrivalDate, ArrivalTime, Price
+        FROM Flights JOIN FlightInfo ON Flights.FlightID = FlightInfo.FlightID ORDER BY Flights.rowid
+    ''', [("FlightNo", "text"), ("Airline", "text"), ("DeptAirport", "text"), ("ArrivalAirport", "text"),
+          ("DeptDate", "text"), ("DeptTime", "text"), ("ArrivalDate", "text"), ("ArrivalTime", "text"), ("Price", "number")])
+    table["DeptDay"] = _day_numbers(table["DeptDate"])
+    # Route and day packed into one int64 per flight: airport codes in the high bits, day in the low 32
+    table["route_index"] = _sorted_index(_route_key(table["DeptAirport"].codes, table["ArrivalAirport"].codes,
+                                                    table["DeptDay"]))
+    return table
+
+
+def _route_key(dept_codes, arrival_codes, days):
+    return (np.asarray(dept_codes, np.int64) << 48) + (np.asarray(arrival_codes, np.int64) << 32) + days
+
+
+def load_hotels(conn):
+    table = _load(conn, '''
+        SELECT Hotels.rowid, HotelName, Address, Price, Rating
+        FROM Hotels JOIN HotelInfo ON Hotels.HotelID = HotelInfo.HotelID ORDER BY Hotels.rowid
+    ''', [("HotelName", "text"), ("Address", "text"), ("Price", "number"), ("Rating", "number")])
+    table["location_index"] = _sorted_index(table["Address"].codes)
+    return table
+
+
+def load_cars(conn):
+    table = _load(conn, '''
+        SELECT rowid, PickupTime, RentalCompany, IsAvailable, Price, DropLocation, DropDate, DropTime, PickupLocation
+        FROM Cars ORDER BY rowid
+    ''', [("PickupTime", "text"), ("RentalCompany", "text"), ("IsAvailable", "text"), ("Price", "number"),
+          ("DropLocation", "text"), ("DropDate", "text"), ("DropTime", "text"), ("PickupLocation", "text")])
+    table["location_index"] = _sorted_index(table["PickupLocation"].codes)
+    return table
+
+
+def availability_loader(kind):
+    def load(conn):
+        # Each (listing, day) packed into one sorted int64 key, with a running count of
+        # days that still have capacity; a range check is two binary searches
+        rows = conn.execute(f"SELECT ItemRow, Day, Capacity > 0 FROM {availability.KINDS[kind].availability} ORDER BY ItemRow, Day").fetchall()
+        items, days, free = (np.array(column, dtype=np.int64) for column in zip(*rows)) if rows else (np.zeros(0, np.int64),) * 3
+        return {"keys": (items << 32) + days, "free": np.concatenate(([0], np.cumsum(free)))}
+    return load
+
+
+def _nbytes(value):
+    if isinstance(value, dict):
+        return sum(_nbytes(item) for item in value.values())
+    if isinstance(value, tuple):
+        return sum(_nbytes(item) for item in value)
+    return getattr(value, "nbytes", 0)
+
+
+class Snapshot:
+    # One table held in memory as loaded at a given value of its change counter.
+    # Reloaded when the counter moves; meanwhile other threads keep reading the
+    # previous copy rather than wait.
+    def __init__(self, table, loader):
+        self.table = table
+        self.loader = loader
+        self._lock = threading.Lock()
+        self._data = None
+        self._path = None
+        self._version = None
+        self._stats = {"loads": 0, "last_load_seconds": 0.0, "bytes": 0}
+
+    def get(self):
+        pool = db.get_pool()
+        version = cache.catalog_versions.current((self.table,))[0]
+        if pool.path == self._path and version == self._version:
+            return self._data
+        if pool.path == self._path:
+            if not self._lock.acquire(blocking=False):
+                return self._data
+        else:
+            self._lock.acquire()
+        try:
+            if pool.path != self._path or version != self._version:
+                start = time.perf_counter()
+                with pool.connection() as conn:
+                    # Read the counter first: a write landing during the load moves it
+                    # again, so the next call reloads instead of keeping a stale copy
+                    loaded_version = cache.read_versions(conn).get(self.table, 0)
+                    data = self.loader(conn)
+                self._data, self._path, self._version = data, pool.path, loaded_version
+                self._stats["loads"] += 1
+                self._stats["last_load_seconds"] = time.perf_counter() - start
+                self._stats["bytes"] = _nbytes(data)
+            return self._data
+        finally:
+            self._lock.release()
+
+    def stats(self):
+        return dict(self._stats)
+
+
+flights = Snapshot("Flights", load_flights)
+hotels = Snapshot("Hotels", load_hotels)
+cars = Snapshot("Cars", load_cars)
+hotel_availability = Snapshot(availability.KINDS["hotel"].availability, availability_loader("hotel"))
+car_availability = Snapshot(availability.KINDS["car"].availability, availability_loader("car"))
+
+
+SNAPSHOTS = (flights, hotels, cars, hotel_availability, car_availability)
+
+
+def warm():
+    for snapshot in SNAPSHOTS:
+        snapshot.get()
+
+
+def _available(free_days, listings, days):
+    # Which listings have capacity on every day of (first, last)
+    first, last = days
+    lo = np.searchsorted(free_days["keys"], (listings << 32) + first, side="left")
+    hi = np.searchsorted(free_days["keys"], (listings << 32) + last, side="right")
+    return free_days["free"][hi] - free_days["free"][lo] == last - first + 1
+
+
+def _rows(table, rows, columns):
+    return list(zip(*(table[name].take(rows) for name in columns)))
+
+
+def _sql_order(value):
+    # Sort key that orders mixed values the way SQLite does: NULL, numbers, then text
+    if value is None:
+        return (0, 0)
+    return (2, value) if isinstance(value, str) else (1, value)
+
+
+def _page(table, rows, columns, order, after, limit):
+    # The rows of one page sorted by the `order` columns, starting after the
+    # cursor key `after`, as service.keyset_page pages SQL results. Returns
+    # (rows, key of the last row, or None on the last page).
+    keys = list(zip(*(table["rowid"][rows].tolist() if name == "rowid" else table[name].take(rows) for name in order)))
+    ranked = sorted(range(len(keys)), key=lambda i: [_sql_order(value) for value in keys[i]])
+    if after is not None:
+        start = [_sql_order(value) for value in after]
+        ranked = [i for i in ranked if [_sql_order(value) for value in keys[i]] > start]
+    page = rows[ranked[:limit]] if ranked else rows[:0]
+    return _rows(table, page, columns), (keys[ranked[limit - 1]] if len(ranked) > limit else None)
+
+
+FLIGHT_COLUMNS = ["FlightNo", "Airline", "DeptDate", "DeptTime", "ArrivalDate", "ArrivalTime", "Price"]
+HOTEL_COLUMNS = ["HotelName", "Address", "Price", "Rating"]
+CAR_COLUMNS = ["PickupTime", "RentalCompany", "IsAvailable", "Price", "DropLocation", "DropDate", "DropTime"]
+
+
+def _flight_rows(dept_airport, arrival_airport, dept_date):
+    table = flights.get()
+    dept, arrival = table["DeptAirport"].code(dept_airport), table["ArrivalAirport"].code(arrival_airport)
+    if dept < 0 or arrival < 0:
+        return table, table["rowid"][:0]
+    return table, _lookup(table["route_index"], _route_key(dept, arrival, availability.day_number(dept_date)))
+
+
+def _hotel_rows(location, entry_date, exit_date):
+    table = hotels.get()
+    days = availability.hotel_days(entry_date, exit_date)
+    if days[1] < days[0]:
+        return table, table["rowid"][:0]
+    rows = _lookup(table["location_index"], table["Address"].code(location))
+    return table, rows[_available(hotel_availability.get(), table["rowid"][rows], days)]
+
+
+def _car_rows(location, pickup_date, drop_date):
+    table = cars.get()
+    days = availability.car_days(pickup_date, drop_date)
+    if days[1] < days[0]:
+        return table, table["rowid"][:0]
+    rows = _lookup(table["location_index"], table["PickupLocation"].code(location))
+    return table, rows[_available(car_availability.get(), table["rowid"][rows], days)]
+
+
+def search_flights(dept_airport, arrival_airport, dept_date):
+    table, rows = _flight_rows(dept_airport, arrival_airport, dept_date)
+    return _rows(table, rows, FLIGHT_COLUMNS)
+
+
+def search_hotels(location, entry_date, exit_date):
+    table, rows = _hotel_rows(location, entry_date, exit_date)
+    return _rows(table, rows, HOTEL_COLUMNS)
+
+
+def search_cars(location, pickup_date, drop_date):
+    table, rows = _car_rows(location, pickup_date, drop_date)
+    return _rows(table, rows, CAR_COLUMNS)
+
+
+# Paged searches, in the same order as the SQL ones in service.py
+def search_flights_page(dept_airport, arrival_airport, dept_date, after, limit):
+    table, rows = _flight_rows(dept_airport, arrival_airport, dept_date)
+    return _page(table, rows, FLIGHT_COLUMNS, ["Price", "DeptTime", "rowid"], after, limit)
+
+
+def search_hotels_page(location, entry_date, exit_date, after, limit):
+    table, rows = _hotel_rows(location, entry_date, exit_date)
+    return _page(table, rows, HOTEL_COLUMNS, ["Price", "rowid"], after, limit)
+
+
+def search_cars_page(location, pickup_date, drop_date, after, limit):
+    table, rows = _car_rows(location, pickup_date, drop_date)
+    return _page(table, rows, CAR_COLUMNS, ["Price", "PickupTime", "rowid"], after, limit)
+
+
+def stats():
+    return {snapshot.table: snapshot.stats() for snapshot in SNAPSHOTS}
+
+
+def benchmark(path, count=500, seed=2):
+    # Times the same sampled searches on the SQL and columnar engines and checks
+    # that both return the same rows
+    import service
+
+    db.configure(path)
+    conn = sqlite3.connect(path)
+    rng = random.Random(seed)
+    samples = {
+        "flights": conn.execute("SELECT DeptAirport, ArrivalAirport, DeptDate FROM Flights").fetchall(),
+        "hotels": conn.execute("SELECT Address, EntryDate, ExitDate FROM Hotels").fetchall(),
+        "cars": conn.execute("SELECT PickupLocation, PickupDate, DropDate FROM Cars").fetchall(),
+    }
+    conn.close()
+    searches = {"flights": service.query_flights, "hotels": service.query_hotels, "cars": service.query_cars}
+    previous = ENGINE
+    configure("columnar")
+    start = time.perf_counter()
+    warm()
+    print(f"snapshot loaded in {(time.perf_counter() - start) * 1000:.1f} ms, "
+          f"{sum(s['bytes'] for s in stats().values()) / 1e6:.1f} MB")
+
+    try:
+        for kind, search in searches.items():
+            calls = [rng.choice(samples[kind]) for _ in range(count)] if samples[kind] else []
+            results = {}
+            for engine in ENGINES:
+                configure(engine)
+                start = time.perf_counter()
+                found = [search(*params) for params in calls]
+                elapsed = time.perf_counter() - start
+                results[engine] = [sorted(tuple(row) for row in rows) for rows in found]
+                print(f"search_{kind:<8} {engine:<9} {elapsed * 1000:9.1f} ms  {elapsed / max(count, 1) * 1e6:9.1f} us/search")
+            mismatches = sum(a != b for a, b in zip(results["sql"], results["columnar"]))
+            if mismatches:
+                print(f"search_{kind:<8} {mismatches} of {count} results differ")
+    finally:
+        configure(previous)
+
+if __name__ == "__main__":
+    benchmark(sys.argv[1] if len(sys.argv) > 1 else db.DB_PATH)
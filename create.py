@@ -1,8 +1,9 @@
 import sqlite3
+import availability
+import booking_ids
+import migrations
 
-# Connect to (or create) the SQLite database
-conn = sqlite3.connect('travel_booking.db')
-cursor = conn.cursor()
+DB_PATH = 'travel_booking.db'
 
 # SQL queries to create tables
 tables = [
@@ -100,10 +101,6 @@ tables = [
     )'''
 ]
 
-# Create tables
-for table in tables:
-    cursor.execute(table)
-
 # Insert initial data into tables
 data = {
     "Users": {
@@ -190,15 +187,33 @@ data = {
     }
 }
 
-# Insert data into tables
-for table_name, content in data.items():
-    columns = ', '.join(content["columns"])
-    placeholders = ', '.join('?' * len(content["columns"]))
-    for value in content["values"]:
-        cursor.execute(f'INSERT INTO {table_name} ({columns}) VALUES ({placeholders})', value)
 
-# Commit the changes and close the connection
-conn.commit()
-conn.close()
+def create_database(path=DB_PATH):
+    # Connect to (or create) the SQLite database
+    conn = sqlite3.connect(path)
+    cursor = conn.cursor()
+
+    # Create tables and indexes
+    migrations.migrate(conn)
+
+    # Insert data into tables
+    for table_name, content in data.items():
+        columns = ', '.join(content["columns"])
+        placeholders = ', '.join('?' * len(content["columns"]))
+        cursor.executemany(f'INSERT INTO {table_name} ({columns}) VALUES ({placeholders})', content["values"])
+
+    # Open up per-day capacity for the hotel and car listings just inserted
+    for kind in availability.KINDS:
+        availability.populate(conn, kind)
+
+    # The migrations started the ID sequences before any seed rows existed
+    booking_ids.advance_sequence(conn)
+
+    # Commit the changes and close the connection
+    conn.commit()
+    conn.close()
+
 
-print("Database and tables created, and data inserted successfully.")
+if __name__ == "__main__":
+    create_database()
+    print("Database and tables created, and data inserted successfully.")
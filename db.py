@@ -0,0 +1,171 @@
+import os
+import queue
+import sqlite3
+import threading
+import time
+import urllib.parse
+from contextlib import contextmanager
+
+import migrations
+import tracing
+
+DB_PATH = os.environ.get('TRAVEL_BOOKING_DB', 'travel_booking.db')
+
+# Applied to every pooled connection when it is opened
+PRAGMAS = [
+    "PRAGMA journal_mode = WAL",
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA cache_size = -16000",
+    "PRAGMA mmap_size = 268435456",
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA busy_timeout = 5000",
+]
+
+
+def _uri(path):
+    return "file:" + urllib.parse.quote(os.path.abspath(path))
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+class ConnectionPool:
+    def __init__(self, path=DB_PATH, max_size=8, timeout=30.0, cached_statements=256, attach=None):
+        self.path = path
+        # {schema name: path} of databases attached read-only to every connection
+        self.attach = attach or {}
+        self.max_size = max_size
+        self.timeout = timeout
+        self.cached_statements = cached_statements
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._all = []
+        self._stats = {
+            "checkouts": 0,
+            "waits": 0,
+            "wait_time_total": 0.0,
+            "wait_time_max": 0.0,
+            "timeouts": 0,
+        }
+
+    def _connect(self):
+        # cached_statements keeps prepared statements alive per connection, so the
+        # same SQL text is only parsed once for the lifetime of the connection
+        # Attaching by URI needs the connection itself opened with URI filenames on
+        path, uri = (_uri(self.path), True) if self.attach else (self.path, False)
+        conn = sqlite3.connect(path, uri=uri, check_same_thread=False, cached_statements=self.cached_statements,
+                               factory=tracing.TracedConnection)
+        conn.row_factory = sqlite3.Row
+        for pragma in PRAGMAS:
+            conn.execute(pragma)
+        for name, path in self.attach.items():
+            # Read-only, so BEGIN IMMEDIATE here never takes that database's write lock
+            conn.execute(f"ATTACH DATABASE ? AS {name}", (_uri(path) + "?mode=ro",))
+        return conn
+
+    def _checkout(self):
+        start = time.perf_counter()
+        try:
+            conn = self._idle.get_nowait()
+        except queue.Empty:
+            conn = None
+            with self._lock:
+                if len(self._all) < self.max_size:
+                    conn = self._connect()
+                    self._all.append(conn)
+            if conn is None:
+                try:
+                    conn = self._idle.get(timeout=self.timeout)
+                except queue.Empty:
+                    with self._lock:
+                        self._stats["timeouts"] += 1
+                    raise PoolTimeout(f"No database connection available after {self.timeout}s")
+                waited = time.perf_counter() - start
+                with self._lock:
+                    self._stats["waits"] += 1
+                    self._stats["wait_time_total"] += waited
+                    self._stats["wait_time_max"] = max(self._stats["wait_time_max"], waited)
+        with self._lock:
+            self._stats["checkouts"] += 1
+        return conn
+
+    @contextmanager
+    def connection(self):
+        # Nested checkouts on the same thread share one connection, so helpers that
+        # call other helpers never hold two connections at once
+        held = getattr(self._local, "conn", None)
+        if held is not None:
+            yield held
+            return
+
+        conn = self._checkout()
+        self._local.conn = conn
+        try:
+            yield conn
+            if conn.in_transaction:
+                conn.commit()
+        except BaseException:
+            if conn.in_transaction:
+                conn.rollback()
+            raise
+        finally:
+            self._local.conn = None
+            self._idle.put(conn)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["size"] = len(self._all)
+        stats["max_size"] = self.max_size
+        stats["idle"] = self._idle.qsize()
+        stats["in_use"] = stats["size"] - stats["idle"]
+        stats["wait_time_avg"] = stats["wait_time_total"] / stats["waits"] if stats["waits"] else 0.0
+        return stats
+
+    def close_all(self):
+        with self._lock:
+            for conn in self._all:
+                conn.close()
+            self._all = []
+            self._idle = queue.LifoQueue()
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _open_pool(path, migrate=True, **kwargs):
+    pool = ConnectionPool(path, **kwargs)
+    if migrate:
+        # Bring the schema and indexes up to date before the first request is served
+        with pool.connection() as conn:
+            migrations.migrate(conn)
+    return pool
+
+
+def get_pool():
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = _open_pool(DB_PATH)
+    return _pool
+
+
+def configure(path=DB_PATH, **kwargs):
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.close_all()
+        _pool = _open_pool(path, **kwargs)
+    return _pool
+
+
+def connection():
+    return get_pool().connection()
+
+
+def pool_stats():
+    return get_pool().stats()
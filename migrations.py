@@ -0,0 +1,323 @@
+import sqlite3
+import sys
+
+import availability
+import create
+import reports
+
+# Covering indexes for the search and booking hot paths. Each one holds every
+# column its query reads, so SQLite answers from the index without touching the table.
+SEARCH_INDEXES = [
+    '''CREATE INDEX IF NOT EXISTS idx_flights_route
+        ON Flights (DeptAirport, ArrivalAirport, DeptDate, FlightID, FlightNo, DeptTime, ArrivalDate, ArrivalTime, Price)''',
+    '''CREATE INDEX IF NOT EXISTS idx_hotels_location_dates
+        ON Hotels (Address, EntryDate, ExitDate, HotelID, Price, Rating)''',
+    '''CREATE INDEX IF NOT EXISTS idx_cars_pickup_dates
+        ON Cars (PickupLocation, PickupDate, DropDate, PickupTime, RentalCompany, IsAvailable, Price, DropLocation, DropTime)''',
+    '''CREATE INDEX IF NOT EXISTS idx_booking_user
+        ON Booking (UserID, BookingID, HotelID, CarID, TotalAmt)''',
+]
+
+
+# Name lookups and per-item price lookups used by pricing.py. Entries for one ID
+# are ordered by rowid, so "LIMIT 1" through these still returns the first row.
+PRICING_INDEXES = [
+    "CREATE INDEX IF NOT EXISTS idx_flightinfo_airline ON FlightInfo (Airline)",
+    "CREATE INDEX IF NOT EXISTS idx_hotelinfo_name ON HotelInfo (HotelName)",
+    "CREATE INDEX IF NOT EXISTS idx_carsinfo_type ON CarsInfo (CarType)",
+    "CREATE INDEX IF NOT EXISTS idx_flights_id ON Flights (FlightID)",
+    "CREATE INDEX IF NOT EXISTS idx_hotels_id ON Hotels (HotelID)",
+    "CREATE INDEX IF NOT EXISTS idx_cars_id ON Cars (CarID)",
+]
+
+
+# Search indexes with the keyset sort columns straight after the equality columns,
+# so pages come off the index in order without sorting the whole result
+KEYSET_INDEXES = [
+    '''CREATE INDEX IF NOT EXISTS idx_flights_route_price
+        ON Flights (DeptAirport, ArrivalAirport, DeptDate, Price, DeptTime, FlightID, FlightNo, ArrivalDate, ArrivalTime)''',
+    '''CREATE INDEX IF NOT EXISTS idx_cars_pickup_price
+        ON Cars (PickupLocation, PickupDate, DropDate, Price, PickupTime, RentalCompany, IsAvailable, DropLocation, DropTime)''',
+]
+
+
+# Hotel and car searches check dates against the availability tables rather than
+# the listing's own date columns, so these hold the location and then the keyset
+# sort columns. rowid, the last sort column, ends every index implicitly and cannot
+# be named, so nothing may come after the others: the indexes give up covering the
+# query for returning each page in order, without sorting the whole location.
+LISTING_PRICE_INDEXES = [
+    "CREATE INDEX IF NOT EXISTS idx_hotels_location_price ON Hotels (Address, Price)",
+    "CREATE INDEX IF NOT EXISTS idx_cars_location_price ON Cars (PickupLocation, Price, PickupTime)",
+]
+
+
+# Tables whose contents feed the in-process caches. Every write to them bumps a
+# per-table counter so caches in any process can tell their entries are stale.
+CATALOG_TABLES = ("Flights", "Hotels", "Cars")
+
+
+def _base_schema(conn):
+    for table in create.tables:
+        conn.execute(table)
+
+
+def _search_indexes(conn):
+    for index in SEARCH_INDEXES:
+        conn.execute(index)
+
+
+def _version_triggers(conn, table):
+    conn.execute("INSERT OR IGNORE INTO CatalogVersion (TableName, Version) VALUES (?, 0)", (table,))
+    for event in ("INSERT", "UPDATE", "DELETE"):
+        conn.execute(f'''CREATE TRIGGER IF NOT EXISTS trg_{table.lower()}_{event.lower()}_version
+            AFTER {event} ON {table}
+            BEGIN
+                UPDATE CatalogVersion SET Version = Version + 1 WHERE TableName = '{table}';
+            END''')
+
+
+def _catalog_versions(conn):
+    conn.execute('''CREATE TABLE IF NOT EXISTS CatalogVersion (
+        TableName TEXT PRIMARY KEY,
+        Version INTEGER NOT NULL DEFAULT 0
+    )''')
+    for table in CATALOG_TABLES:
+        _version_triggers(conn, table)
+
+
+def _pricing_indexes(conn):
+    for index in PRICING_INDEXES:
+        conn.execute(index)
+
+
+def _booking_sequence(conn):
+    conn.execute('''CREATE TABLE IF NOT EXISTS BookingSequence (
+        Name TEXT PRIMARY KEY,
+        NextValue INTEGER NOT NULL
+    )''')
+    # Start after the highest numeric ID in use; existing IDs are "B" followed by digits
+    conn.execute('''INSERT OR IGNORE INTO BookingSequence (Name, NextValue)
+        SELECT 'Booking', COALESCE(MAX(CAST(SUBSTR(BookingID, 2) AS INTEGER)), 0) + 1 FROM Booking''')
+
+
+def _keyset_indexes(conn):
+    for index in KEYSET_INDEXES:
+        conn.execute(index)
+    # Superseded: the new indexes cover the same queries
+    conn.execute("DROP INDEX IF EXISTS idx_flights_route")
+    conn.execute("DROP INDEX IF EXISTS idx_cars_pickup_dates")
+
+
+def _availability(conn):
+    for kind, inventory in availability.KINDS.items():
+        # Keyed by listing then day, so a date range is one contiguous stretch of the key
+        conn.execute(f'''CREATE TABLE IF NOT EXISTS {inventory.availability} (
+            ItemRow INTEGER NOT NULL,
+            Day INTEGER NOT NULL,
+            Capacity INTEGER NOT NULL,
+            PRIMARY KEY (ItemRow, Day)
+        ) WITHOUT ROWID''')
+        # Listings are referenced by rowid, which SQLite keeps stable as long as the
+        # database is never VACUUMed
+        conn.execute(f'''CREATE TRIGGER IF NOT EXISTS trg_{inventory.table.lower()}_delete_availability
+            AFTER DELETE ON {inventory.table}
+            BEGIN
+                DELETE FROM {inventory.availability} WHERE ItemRow = OLD.rowid;
+            END''')
+        availability.populate(conn, kind)
+        _version_triggers(conn, inventory.availability)
+    # What each booking holds, so cancel and modify can give it back
+    conn.execute('''CREATE TABLE IF NOT EXISTS BookingInventory (
+        BookingID TEXT NOT NULL,
+        Kind TEXT NOT NULL,
+        ItemRow INTEGER NOT NULL,
+        FirstDay INTEGER NOT NULL,
+        LastDay INTEGER NOT NULL,
+        PRIMARY KEY (BookingID, Kind)
+    ) WITHOUT ROWID''')
+
+
+def _notification_outbox(conn):
+    # Rows from before delivery tracking count as sent
+    for column in ("Status TEXT NOT NULL DEFAULT 'sent'", "Attempts INTEGER NOT NULL DEFAULT 0",
+                   "NextAttempt REAL", "CreatedAt REAL", "DeliveredAt REAL", "LastError TEXT"):
+        conn.execute(f"ALTER TABLE Notifications ADD COLUMN {column}")
+    # Only undelivered rows are indexed, so claiming stays cheap however much history
+    # piles up; Status is included so the claim reads nothing but the index
+    conn.execute('''CREATE INDEX IF NOT EXISTS idx_notifications_due
+        ON Notifications (NextAttempt, Status) WHERE Status IN ('pending', 'sending')''')
+
+
+def _report_aggregates(conn):
+    reports.create(conn)
+    reports.rebuild(conn)
+
+
+def _user_directory(conn):
+    # Used when user data is sharded: finds a user's ID, and so their shard, from the
+    # username at login. UserIDs then come from the 'User' row of BookingSequence,
+    # so they stay unique across shards.
+    conn.execute('''CREATE TABLE IF NOT EXISTS UserDirectory (
+        Username TEXT PRIMARY KEY,
+        UserID INTEGER NOT NULL UNIQUE
+    )''')
+    conn.execute('''INSERT OR IGNORE INTO BookingSequence (Name, NextValue)
+        SELECT 'User', COALESCE(MAX(UserID), 0) + 1 FROM Users''')
+
+
+def _capacity_journal(conn):
+    # Sharded, a booking's capacity change commits in the catalog before its shard
+    # write does. Each change is journaled with what the booking held before, until
+    # it is settled: kept if the shard write committed, undone if it never did.
+    conn.execute('''CREATE TABLE IF NOT EXISTS CapacityJournal (
+        ChangeID INTEGER PRIMARY KEY AUTOINCREMENT,
+        BookingID TEXT NOT NULL,
+        UserID INTEGER NOT NULL,
+        Held TEXT NOT NULL
+    )''')
+
+
+def _applied_capacity(conn):
+    # Written in the shard write's own transaction: the journaled change it names
+    # committed along with it
+    conn.execute("CREATE TABLE IF NOT EXISTS AppliedCapacity (ChangeID INTEGER PRIMARY KEY)")
+
+
+def _listing_price_indexes(conn):
+    for index in LISTING_PRICE_INDEXES:
+        conn.execute(index)
+    # Superseded: they lead with dates the searches no longer filter on, so every
+    # page had to sort the whole location by price
+    conn.execute("DROP INDEX IF EXISTS idx_hotels_location_dates")
+    conn.execute("DROP INDEX IF EXISTS idx_cars_pickup_price")
+
+
+def _shard_tables(conn):
+    for table in create.tables:
+        if any(f"EXISTS {name} (" in table for name in USER_TABLES):
+            conn.execute(table)
+    for index in SEARCH_INDEXES:
+        if "ON Booking " in index:
+            conn.execute(index)
+
+
+# (version, description, apply) in the order they must run. The applied version is
+# stored in PRAGMA user_version, so append new steps and never renumber old ones.
+MIGRATIONS = [
+    (1, "base schema", _base_schema),
+    (2, "covering indexes for search and booking queries", _search_indexes),
+    (3, "catalog change counters", _catalog_versions),
+    (4, "indexes for itinerary pricing", _pricing_indexes),
+    (5, "booking ID sequence", _booking_sequence),
+    (6, "keyset pagination indexes", _keyset_indexes),
+    (7, "per-day hotel and car availability", _availability),
+    (8, "notification outbox", _notification_outbox),
+    (9, "materialized report aggregates", _report_aggregates),
+    (10, "user directory for sharding", _user_directory),
+    (11, "capacity change journal", _capacity_journal),
+    (12, "location and price indexes for hotel and car pages", _listing_price_indexes),
+]
+
+# Schema of a user data shard. Catalog tables are read from the attached catalog
+# database instead, so only the per-user tables and what hangs off them live here.
+USER_TABLES = ("Users", "Booking", "Payment", "Notifications")
+SHARD_MIGRATIONS = [
+    (1, "user tables", _shard_tables),
+    (2, "notification outbox", _notification_outbox),
+    (3, "materialized report aggregates", _report_aggregates),
+    (4, "applied capacity changes", _applied_capacity),
+]
+
+# Checked for serving their query in order rather than for covering it
+PAGE_ORDER_INDEXES = ("idx_hotels_location_price", "idx_cars_location_price")
+
+# The hot-path queries and the index EXPLAIN QUERY PLAN must report for each
+PLAN_CHECKS = [
+    ("search_flights", "idx_flights_route_price", '''
+        SELECT Flights.FlightNo, FlightInfo.Airline, Flights.DeptDate, Flights.DeptTime,
+               Flights.ArrivalDate, Flights.ArrivalTime, Flights.Price
+        FROM Flights
+        JOIN FlightInfo ON Flights.FlightID = FlightInfo.FlightID
+        WHERE Flights.DeptAirport = ? AND Flights.ArrivalAirport = ? AND Flights.DeptDate = ?
+    ''', ("JFK", "LAX", "2024-08-01")),
+    ("search_hotels", "idx_hotels_location_price", '''
+        SELECT HotelInfo.HotelName, Hotels.Address, Hotels.Price, Hotels.Rating, Hotels.Price, Hotels.rowid
+        FROM Hotels
+        JOIN HotelInfo ON Hotels.HotelID = HotelInfo.HotelID
+        WHERE Hotels.Address = ? AND ''' + availability.available_sql("hotel", "Hotels.rowid") + '''
+        ORDER BY Hotels.Price, Hotels.rowid LIMIT ?''',
+        ("New York", 19937, 19939, 3, 51)),
+    ("search_cars", "idx_cars_location_price", '''
+        SELECT PickupTime, RentalCompany, IsAvailable, Price, DropLocation, DropDate, DropTime, Price, PickupTime, rowid
+        FROM Cars
+        WHERE PickupLocation = ? AND ''' + availability.available_sql("car", "Cars.rowid") + '''
+        ORDER BY Price, PickupTime, rowid LIMIT ?''',
+        ("101 Airport Rd", 19967, 19973, 7, 51)),
+    ("view_bookings", "idx_booking_user", '''
+        SELECT BookingID, HotelInfo.HotelName, CarsInfo.CarType, TotalAmt
+        FROM Booking
+        JOIN HotelInfo ON Booking.HotelID = HotelInfo.HotelID
+        JOIN CarsInfo ON Booking.CarID = CarsInfo.CarID
+        WHERE UserID = ?
+    ''', (1,)),
+    ("claim_notifications", "idx_notifications_due", '''
+        SELECT NotificationID FROM Notifications
+        WHERE Status IN ('pending', 'sending') AND NextAttempt <= ?
+        ORDER BY NextAttempt LIMIT ?
+    ''', (0, 50)),
+]
+
+
+def schema_version(conn):
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate(conn, target=None, steps=MIGRATIONS):
+    if conn.in_transaction:
+        conn.commit()
+    for version, description, apply in steps:
+        if target is not None and version > target:
+            break
+        if schema_version(conn) >= version:
+            continue
+        # BEGIN IMMEDIATE takes the write lock up front, so two processes starting at
+        # once cannot both apply the same step; re-check the version once we hold it
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if schema_version(conn) < version:
+                apply(conn)
+                conn.execute(f"PRAGMA user_version = {version}")
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+    return schema_version(conn)
+
+
+def check_query_plans(conn):
+    # Returns (name, expected index, plan detail, ok) for every hot-path query. A
+    # query that has to sort its rows is not served by its index either.
+    results = []
+    for name, index, query, params in PLAN_CHECKS:
+        plan = conn.execute(f"EXPLAIN QUERY PLAN {query}", params).fetchall()
+        detail = " | ".join(row[3] for row in plan)
+        expected = f"USING INDEX {index}" if index in PAGE_ORDER_INDEXES else f"USING COVERING INDEX {index}"
+        ok = any(expected in row[3] for row in plan) and "USE TEMP B-TREE" not in detail
+        results.append((name, index, detail, ok))
+    return results
+
+
+if __name__ == "__main__":
+    args = [arg for arg in sys.argv[1:] if not arg.startswith("--")]
+    path = args[0] if args else create.DB_PATH
+    conn = sqlite3.connect(path)
+    print(f"Schema version: {migrate(conn)}")
+    if "--check" in sys.argv:
+        failed = False
+        for name, index, detail, ok in check_query_plans(conn):
+            print(f"{'OK  ' if ok else 'FAIL'} {name}: {detail}")
+            failed = failed or not ok
+        conn.close()
+        sys.exit(1 if failed else 0)
+    conn.close()
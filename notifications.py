@@ -0,0 +1,244 @@
+import argparse
+import json
+import os
+import threading
+import time
+from collections import namedtuple
+from datetime import datetime
+
+import db
+import shards
+
+# Notifications doubles as a durable outbox. Rows are added as 'pending' inside
+# the booking transaction, so a notification exists exactly when its booking
+# change committed. Workers claim due rows by moving them to 'sending' with
+# NextAttempt pushed out by LEASE seconds; a worker that dies mid-batch leaves
+# rows whose lease runs out and that the next claim picks up again.
+NOTIFICATION_LOG = os.environ.get('TRAVEL_BOOKING_NOTIFICATION_LOG', 'notifications.log')
+WORKERS = 2
+BATCH_SIZE = 50
+POLL_INTERVAL = 1.0
+LEASE = 60.0
+# Failed deliveries are retried after RETRY_BASE * 2**(attempts - 1) seconds, at
+# most RETRY_MAX, and given up as 'failed' after MAX_ATTEMPTS tries
+MAX_ATTEMPTS = 5
+RETRY_BASE = 5.0
+RETRY_MAX = 3600.0
+
+Notification = namedtuple("Notification", ["id", "user_id", "booking_id", "type", "message", "channel",
+                                           "email", "phone", "attempts", "created_at"])
+
+
+class FileSender:
+    # Appends each notification as a JSON line instead of sending it; the default,
+    # and handy for development and tests
+    def __init__(self, path=NOTIFICATION_LOG):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def __call__(self, notification):
+        line = json.dumps(dict(notification._asdict(), delivered_at=time.time()))
+        with self._lock, open(self.path, "a") as f:
+            f.write(line + "\n")
+
+
+_default_sender = FileSender()
+# How each NotificationType is delivered: a callable taking a Notification that
+# raises if delivery failed. Types with none registered go to the file sender.
+SENDERS = {}
+
+
+def register(channel, sender):
+    SENDERS[channel] = sender
+
+
+def sender(channel):
+    return SENDERS.get(channel, _default_sender)
+
+
+def enqueue(conn, user_id, booking_id, kind, message, channel="Email"):
+    # Called inside the writer's transaction; the row commits or rolls back with it
+    now = time.time()
+    conn.execute('''
+        INSERT INTO Notifications (UserID, BookingID, Type, Message, SentDate, NotificationType, Status, NextAttempt, CreatedAt)
+        VALUES (?, ?, ?, ?, ?, ?, 'pending', ?, ?)
+    ''', (user_id, booking_id, kind, message, datetime.now().strftime('%Y-%m-%d'), channel, now, now))
+
+
+def claim(conn, limit=BATCH_SIZE, lease=LEASE):
+    # Takes up to `limit` due rows, oldest due first, in one statement
+    now = time.time()
+    rows = conn.execute('''
+        UPDATE Notifications SET Status = 'sending', NextAttempt = ?, Attempts = Attempts + 1
+        WHERE NotificationID IN (
+            SELECT NotificationID FROM Notifications
+            WHERE Status IN ('pending', 'sending') AND NextAttempt <= ?
+            ORDER BY NextAttempt LIMIT ?
+        )
+        RETURNING NotificationID, UserID, BookingID, Type, Message, NotificationType, Attempts, CreatedAt
+    ''', (now + lease, now, limit)).fetchall()
+    if not rows:
+        return []
+    user_ids = sorted({row[1] for row in rows})
+    contacts = {row[0]: (row[1], row[2]) for row in conn.execute(
+        f"SELECT UserID, Email, PhoneNo FROM Users WHERE UserID IN ({', '.join('?' * len(user_ids))})", user_ids)}
+    return [Notification(row[0], row[1], row[2], row[3], row[4], row[5], *contacts.get(row[1], (None, None)),
+                         row[6], row[7]) for row in rows]
+
+
+def retry_delay(attempts):
+    return min(RETRY_MAX, RETRY_BASE * 2 ** (attempts - 1))
+
+
+class Dispatcher:
+    # A pool of threads that claim batches from the outbox and deliver them.
+    # Any number of dispatchers, in any number of processes, can share one database.
+    def __init__(self, workers=WORKERS, batch_size=BATCH_SIZE, poll_interval=POLL_INTERVAL):
+        self.workers = workers
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._threads = []
+        self._lock = threading.Lock()
+        self._stats = {"delivered": 0, "retried": 0, "failed": 0, "batches": 0,
+                       "latency_total": 0.0, "latency_max": 0.0}
+
+    def start(self):
+        self._stop.clear()
+        for index in range(self.workers):
+            thread = threading.Thread(target=self._run, name=f"notifications-{index}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    def wake(self):
+        # New rows are waiting; saves them sitting until the next poll
+        self._wake.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                claimed = self.process_batch()
+            except Exception:
+                # Database trouble: back off for a poll and try again
+                claimed = 0
+            if claimed < self.batch_size:
+                self._wake.wait(self.poll_interval)
+                self._wake.clear()
+
+    def process_batch(self):
+        # One batch from every database holding an outbox: the catalog, or each shard
+        return sum(self._process(pool) for pool in shards.pools())
+
+    def _process(self, pool):
+        with pool.connection() as conn:
+            batch = claim(conn, self.batch_size)
+        if not batch:
+            return 0
+        # Delivery happens with no connection held: senders may be slow
+        delivered, failed = [], []
+        for notification in batch:
+            try:
+                sender(notification.channel)(notification)
+            except Exception as e:
+                failed.append((notification, f"{type(e).__name__}: {e}"))
+            else:
+                delivered.append((notification, time.time()))
+        self._finish(pool, delivered, failed)
+        return len(batch)
+
+    def _finish(self, pool, delivered, failed):
+        now = time.time()
+        today = datetime.now().strftime('%Y-%m-%d')
+        with pool.connection() as conn:
+            conn.executemany('''
+                UPDATE Notifications SET Status = 'sent', SentDate = ?, DeliveredAt = ?, LastError = NULL
+                WHERE NotificationID = ?
+            ''', [(today, delivered_at, notification.id) for notification, delivered_at in delivered])
+            conn.executemany('''
+                UPDATE Notifications SET Status = ?, NextAttempt = ?, LastError = ?
+                WHERE NotificationID = ?
+            ''', [("failed" if notification.attempts >= MAX_ATTEMPTS else "pending",
+                   now + retry_delay(notification.attempts), error, notification.id)
+                  for notification, error in failed])
+        with self._lock:
+            self._stats["batches"] += 1
+            self._stats["delivered"] += len(delivered)
+            for notification, error in failed:
+                self._stats["failed" if notification.attempts >= MAX_ATTEMPTS else "retried"] += 1
+            for notification, delivered_at in delivered:
+                latency = delivered_at - notification.created_at if notification.created_at else 0.0
+                self._stats["latency_total"] += latency
+                self._stats["latency_max"] = max(self._stats["latency_max"], latency)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        stats["workers"] = len(self._threads)
+        stats["latency_avg"] = stats["latency_total"] / stats["delivered"] if stats["delivered"] else 0.0
+        return stats
+
+
+dispatcher = Dispatcher()
+
+
+def wake():
+    dispatcher.wake()
+
+
+def queue_stats():
+    # Queue depth by status and the age of the oldest undelivered row, from the table
+    # itself, so the numbers cover every process feeding or draining the outbox
+    counts, oldest = {}, None
+    for pool in shards.pools():
+        with pool.connection() as conn:
+            for status, count in conn.execute('''
+                SELECT Status, COUNT(*) FROM Notifications WHERE Status IN ('pending', 'sending', 'failed') GROUP BY Status
+            '''):
+                counts[status] = counts.get(status, 0) + count
+            first = conn.execute('''
+                SELECT MIN(CreatedAt) FROM Notifications WHERE Status IN ('pending', 'sending')
+            ''').fetchone()[0]
+        if first is not None and (oldest is None or first < oldest):
+            oldest = first
+    return {
+        "pending": counts.get("pending", 0),
+        "sending": counts.get("sending", 0),
+        "failed": counts.get("failed", 0),
+        "oldest_pending_seconds": time.time() - oldest if oldest else 0.0,
+    }
+
+
+def stats():
+    stats = queue_stats()
+    stats.update(dispatcher.stats())
+    return stats
+
+
+if __name__ == "__main__":
+    # Runs delivery workers on their own, e.g. next to the Streamlit app
+    parser = argparse.ArgumentParser(description="Deliver queued notifications.")
+    parser.add_argument("--db", default=db.DB_PATH, help="database file (default: %(default)s)")
+    parser.add_argument("--workers", type=int, default=WORKERS)
+    parser.add_argument("--log", default=NOTIFICATION_LOG, help="file the default sender writes to (default: %(default)s)")
+    parser.add_argument("--shards", type=int, default=shards.SHARDS, help="shard count (default: %(default)s)")
+    args = parser.parse_args()
+
+    db.configure(args.db, max_size=args.workers)
+    shards.configure(args.shards)
+    _default_sender.path = args.log
+    dispatcher = Dispatcher(args.workers).start()
+    try:
+        while True:
+            time.sleep(60)
+            print(json.dumps(stats()), flush=True)
+    except KeyboardInterrupt:
+        dispatcher.stop()
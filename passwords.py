@@ -0,0 +1,201 @@
+import hashlib
+import hmac
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+
+# scrypt cost: N=2**14, r=8 needs 16 MB and tens of milliseconds per hash
+SCRYPT_N = int(os.environ.get('TRAVEL_BOOKING_SCRYPT_N', 2 ** 14))
+SCRYPT_R = 8
+SCRYPT_P = 1
+# Used where OpenSSL has no scrypt
+PBKDF2_ITERATIONS = 600000
+SALT_BYTES = 16
+# hashlib releases the GIL while hashing, so threads run hashes in parallel.
+# Requests beyond the workers queue, and beyond MAX_PENDING are turned away.
+HASH_WORKERS = int(os.environ.get('TRAVEL_BOOKING_HASH_WORKERS', min(4, os.cpu_count() or 1)))
+MAX_PENDING = HASH_WORKERS * 8
+PENDING_TIMEOUT = 2.0
+
+# Failed logins allowed per username, and login attempts allowed per client
+# address, in any WINDOW seconds
+USERNAME_FAILURES = 5
+CLIENT_ATTEMPTS = 30
+WINDOW = 300.0
+MAX_TRACKED = 100000
+
+
+def configure(scrypt_n):
+    # Stored hashes keep their own parameters, so changing this only affects new
+    # hashes; older ones are upgraded at the next successful login
+    global SCRYPT_N
+    if scrypt_n < 2 or scrypt_n & (scrypt_n - 1):
+        raise ValueError("scrypt N must be a power of two greater than 1")
+    SCRYPT_N = scrypt_n
+
+
+class Busy(Exception):
+    pass
+
+
+class TooManyAttempts(Exception):
+    def __init__(self, retry_after):
+        super().__init__(f"Too many login attempts; try again in {retry_after:.0f}s")
+        self.retry_after = retry_after
+
+
+def _scrypt(password, salt, n, r, p):
+    return hashlib.scrypt(password.encode('utf-8'), salt=salt, n=n, r=r, p=p, maxmem=256 * n * r + 1024 * 1024, dklen=32)
+
+
+def _pbkdf2(password, salt, iterations):
+    return hashlib.pbkdf2_hmac('sha256', password.encode('utf-8'), salt, iterations)
+
+
+def _hash(password):
+    salt = os.urandom(SALT_BYTES)
+    if hasattr(hashlib, 'scrypt'):
+        digest = _scrypt(password, salt, SCRYPT_N, SCRYPT_R, SCRYPT_P)
+        return f"scrypt${SCRYPT_N}${SCRYPT_R}${SCRYPT_P}${salt.hex()}${digest.hex()}"
+    return f"pbkdf2_sha256${PBKDF2_ITERATIONS}${salt.hex()}${_pbkdf2(password, salt, PBKDF2_ITERATIONS).hex()}"
+
+
+def _verify(password, stored):
+    # (matches, needs rehash). Rows from before salted hashing hold a bare sha256 hex
+    # digest; those, and hashes made with older cost settings, need a rehash.
+    scheme, _, rest = stored.partition('$')
+    if scheme == 'scrypt':
+        n, r, p, salt, digest = rest.split('$')
+        n, r, p = int(n), int(r), int(p)
+        ok = hmac.compare_digest(_scrypt(password, bytes.fromhex(salt), n, r, p).hex(), digest)
+        return ok, (n, r, p) != (SCRYPT_N, SCRYPT_R, SCRYPT_P)
+    if scheme == 'pbkdf2_sha256':
+        iterations, salt, digest = rest.split('$')
+        ok = hmac.compare_digest(_pbkdf2(password, bytes.fromhex(salt), int(iterations)).hex(), digest)
+        return ok, hasattr(hashlib, 'scrypt') or int(iterations) != PBKDF2_ITERATIONS
+    return hmac.compare_digest(hashlib.sha256(password.encode('utf-8')).hexdigest(), stored), True
+
+
+class HashPool:
+    def __init__(self, workers=HASH_WORKERS, max_pending=MAX_PENDING, timeout=PENDING_TIMEOUT):
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="password-hash")
+        self.workers = workers
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._lock = threading.Lock()
+        self._stats = {"hashes": 0, "rejected": 0, "pending": 0, "hash_time_total": 0.0, "queue_time_total": 0.0}
+
+    def run(self, fn, *args):
+        # Blocks the caller until the hash is done; waits up to `timeout` for room
+        # in the queue, then gives up rather than pile up more work
+        if not self._slots.acquire(timeout=self.timeout):
+            with self._lock:
+                self._stats["rejected"] += 1
+            raise Busy("Password hashing is at capacity; try again shortly")
+        queued = time.perf_counter()
+        with self._lock:
+            self._stats["pending"] += 1
+
+        def job():
+            started = time.perf_counter()
+            try:
+                return fn(*args)
+            finally:
+                with self._lock:
+                    self._stats["hashes"] += 1
+                    self._stats["queue_time_total"] += started - queued
+                    self._stats["hash_time_total"] += time.perf_counter() - started
+
+        try:
+            return self.executor.submit(job).result()
+        finally:
+            with self._lock:
+                self._stats["pending"] -= 1
+            self._slots.release()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        stats["workers"] = self.workers
+        stats["hash_time_avg"] = stats["hash_time_total"] / stats["hashes"] if stats["hashes"] else 0.0
+        return stats
+
+
+class Throttle:
+    # Sliding-window counter per key. Checked before any hashing, so a flood of
+    # guesses is turned away without costing a KDF run each.
+    def __init__(self, limit, window=WINDOW, max_keys=MAX_TRACKED):
+        self.limit = limit
+        self.window = window
+        self.max_keys = max_keys
+        self._lock = threading.Lock()
+        self._events = OrderedDict()
+
+    def retry_after(self, key):
+        now = time.monotonic()
+        with self._lock:
+            events = self._events.get(key)
+            if not events:
+                return 0.0
+            while events and events[0] <= now - self.window:
+                events.popleft()
+            if len(events) < self.limit:
+                return 0.0
+            return events[0] + self.window - now
+
+    def add(self, key):
+        now = time.monotonic()
+        with self._lock:
+            events = self._events.pop(key, None) or deque()
+            events.append(now)
+            self._events[key] = events
+            # Forget the least recently seen keys first
+            while len(self._events) > self.max_keys:
+                self._events.popitem(last=False)
+
+    def reset(self, key):
+        with self._lock:
+            self._events.pop(key, None)
+
+
+pool = HashPool()
+username_failures = Throttle(USERNAME_FAILURES)
+client_attempts = Throttle(CLIENT_ATTEMPTS)
+_dummy = None
+
+
+def hash_password(password):
+    return pool.run(_hash, password)
+
+
+def verify_password(password, stored):
+    if stored is None:
+        # Unknown user: still spend one hash so the response time doesn't reveal it
+        global _dummy
+        if _dummy is None:
+            _dummy = hash_password("")
+        pool.run(_verify, password, _dummy)
+        return False, False
+    return pool.run(_verify, password, stored)
+
+
+def check_login(username, client=None):
+    # Raises TooManyAttempts when the username or the client is over its limit
+    wait = max(username_failures.retry_after(username), client_attempts.retry_after(client) if client else 0.0)
+    if wait > 0:
+        raise TooManyAttempts(wait)
+    if client:
+        client_attempts.add(client)
+
+
+def record_login(username, ok):
+    if ok:
+        username_failures.reset(username)
+    else:
+        username_failures.add(username)
+
+
+def stats():
+    return pool.stats()
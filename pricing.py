@@ -0,0 +1,161 @@
+import sqlite3
+import sys
+import time
+from collections import namedtuple
+
+import cache
+import db
+
+Quote = namedtuple("Quote", ["flight_id", "hotel_id", "car_id", "flight_price", "hotel_price", "car_price", "total"])
+
+
+class UnknownItem(LookupError):
+    pass
+
+
+# Resolves the three names and their prices in one statement. As in the original
+# get_total_price, each item is priced from the first inventory row for its ID.
+QUOTE_SQL = '''
+    WITH ids AS (
+        SELECT (SELECT FlightID FROM FlightInfo WHERE Airline = ?) AS FlightID,
+               (SELECT HotelID FROM HotelInfo WHERE HotelName = ?) AS HotelID,
+               (SELECT CarID FROM CarsInfo WHERE CarType = ?) AS CarID
+    )
+    SELECT FlightID, HotelID, CarID,
+           (SELECT Price FROM Flights WHERE Flights.FlightID = ids.FlightID LIMIT 1) AS FlightPrice,
+           (SELECT Price FROM Hotels WHERE Hotels.HotelID = ids.HotelID LIMIT 1) AS HotelPrice,
+           (SELECT Price FROM Cars WHERE Cars.CarID = ids.CarID LIMIT 1) AS CarPrice
+    FROM ids
+'''
+
+# Every bookable name with its ID and price, for the in-memory price table
+PRICE_TABLE_SQL = '''
+    SELECT 'flight', Airline, FlightID,
+           (SELECT Price FROM Flights WHERE Flights.FlightID = FlightInfo.FlightID LIMIT 1)
+    FROM FlightInfo
+    UNION ALL
+    SELECT 'hotel', HotelName, HotelID,
+           (SELECT Price FROM Hotels WHERE Hotels.HotelID = HotelInfo.HotelID LIMIT 1)
+    FROM HotelInfo
+    UNION ALL
+    SELECT 'car', CarType, CarID,
+           (SELECT Price FROM Cars WHERE Cars.CarID = CarsInfo.CarID LIMIT 1)
+    FROM CarsInfo
+    ORDER BY 1, 3
+'''
+
+
+def _make_quote(flight, hotel, car, row):
+    flight_id, hotel_id, car_id, flight_price, hotel_price, car_price = row
+    for kind, name, item_id, price in (("flight", flight, flight_id, flight_price),
+                                       ("hotel", hotel, hotel_id, hotel_price),
+                                       ("car", car, car_id, car_price)):
+        if item_id is None:
+            raise UnknownItem(f"Unknown {kind}: {name}")
+        if price is None:
+            raise UnknownItem(f"No {kind} inventory priced for {name}")
+    # Summed in the same order as the original get_total_price
+    total = car_price + hotel_price + flight_price
+    return Quote(flight_id, hotel_id, car_id, flight_price, hotel_price, car_price, total)
+
+
+def quote_sql(flight, hotel, car):
+    with db.connection() as conn:
+        row = conn.execute(QUOTE_SQL, (flight, hotel, car)).fetchone()
+    return _make_quote(flight, hotel, car, tuple(row))
+
+
+def priced_listings(conn, booking_quote, hotel_row, car_row):
+    # The quote repriced from the hotel and car listings a booking actually holds,
+    # which need not be the first rows for their IDs
+    hotel_price, car_price = conn.execute(
+        "SELECT (SELECT Price FROM Hotels WHERE rowid = ?), (SELECT Price FROM Cars WHERE rowid = ?)",
+        (hotel_row, car_row)).fetchone()
+    return booking_quote._replace(hotel_price=hotel_price, car_price=car_price,
+                                  total=car_price + hotel_price + booking_quote.flight_price)
+
+
+def load_price_table():
+    table = {"flight": {}, "hotel": {}, "car": {}}
+    with db.connection() as conn:
+        for kind, name, item_id, price in conn.execute(PRICE_TABLE_SQL):
+            # Rows come in ID order, so a duplicated name keeps its lowest ID
+            table[kind].setdefault(name, (item_id, price))
+    return table
+
+
+def price_table():
+    return cache.lookups.get("price_table", ("Flights", "Hotels", "Cars"), load_price_table)
+
+
+def quote(flight, hotel, car):
+    return quote_many([(flight, hotel, car)])[0]
+
+
+def quote_many(itineraries):
+    # Prices any number of (flight, hotel, car) name triples from the shared price table
+    table = price_table()
+    missing = (None, None)
+    quotes = []
+    for flight, hotel, car in itineraries:
+        flight_id, flight_price = table["flight"].get(flight, missing)
+        hotel_id, hotel_price = table["hotel"].get(hotel, missing)
+        car_id, car_price = table["car"].get(car, missing)
+        quotes.append(_make_quote(flight, hotel, car, (flight_id, hotel_id, car_id, flight_price, hotel_price, car_price)))
+    return quotes
+
+
+def legacy_total_price(conn, car_name, house_name, flight_name):
+    # The original get_total_price: three ID lookups then three price selects
+    cursor = conn.cursor()
+    car_id = cursor.execute("SELECT CarID FROM CarsInfo WHERE CarType = ?", (car_name,)).fetchone()[0]
+    house_id = cursor.execute("SELECT HotelID FROM HotelInfo WHERE HotelName = ?", (house_name,)).fetchone()[0]
+    flight_id = cursor.execute("SELECT FlightID FROM FlightInfo WHERE Airline = ?", (flight_name,)).fetchone()[0]
+    car_price = cursor.execute("SELECT Price FROM Cars WHERE CarID = ?", (car_id,)).fetchone()[0]
+    house_price = cursor.execute("SELECT Price FROM Hotels WHERE HotelID = ?", (house_id,)).fetchone()[0]
+    flight_price = cursor.execute("SELECT Price FROM Flights WHERE FlightID = ?", (flight_id,)).fetchone()[0]
+    return car_price + house_price + flight_price
+
+
+def benchmark(path, iterations=2000):
+    db.configure(path)
+    table = price_table()
+    itineraries = [(flight, hotel, car) for flight in table["flight"] for hotel in table["hotel"] for car in table["car"]]
+    calls = [itineraries[i % len(itineraries)] for i in range(iterations)]
+
+    def timed(label, fn):
+        start = time.perf_counter()
+        fn()
+        elapsed = time.perf_counter() - start
+        print(f"{label:<32} {elapsed * 1000:9.1f} ms  {elapsed / iterations * 1e6:9.1f} us/quote")
+
+    def legacy():
+        # Fresh connection per call, as server.py used to do
+        for flight, hotel, car in calls:
+            conn = sqlite3.connect(path)
+            legacy_total_price(conn, car, hotel, flight)
+            conn.close()
+
+    def legacy_pooled():
+        with db.connection() as conn:
+            for flight, hotel, car in calls:
+                legacy_total_price(conn, car, hotel, flight)
+
+    def single_query():
+        for flight, hotel, car in calls:
+            quote_sql(flight, hotel, car)
+
+    def in_memory():
+        for flight, hotel, car in calls:
+            quote(flight, hotel, car)
+
+    print(f"{iterations} quotes over {len(itineraries)} itineraries")
+    timed("get_total_price (new conn)", legacy)
+    timed("get_total_price (pooled)", legacy_pooled)
+    timed("quote_sql (one query)", single_query)
+    timed("quote (price table)", in_memory)
+    timed("quote_many (batch)", lambda: quote_many(calls))
+
+
+if __name__ == "__main__":
+    benchmark(sys.argv[1] if len(sys.argv) > 1 else db.DB_PATH)
@@ -0,0 +1,267 @@
+import argparse
+import os
+import sqlite3
+import sys
+import time
+
+import db
+import shards
+
+# Optional: only the Parquet/Arrow export needs it, so it is imported by the
+# first export rather than by every process that shows a report
+pa = None
+
+# Aggregates kept current by triggers on Booking and Payment, in the same
+# transaction as the write, so a report reads a handful of rows instead of
+# grouping the whole history:
+#   ReportDaily          per day: bookings made (by BookingDate), payments and net revenue
+#   ReportItems          live bookings per flight, hotel and car ID
+#   ReportPaymentMethods payments and net amount per payment method
+AGGREGATE_TABLES = [
+    '''CREATE TABLE IF NOT EXISTS ReportDaily (
+        Day TEXT PRIMARY KEY,
+        Bookings INTEGER NOT NULL DEFAULT 0,
+        Payments INTEGER NOT NULL DEFAULT 0,
+        Revenue REAL NOT NULL DEFAULT 0
+    ) WITHOUT ROWID''',
+    '''CREATE TABLE IF NOT EXISTS ReportItems (
+        Kind TEXT NOT NULL,
+        ItemID INTEGER NOT NULL,
+        Bookings INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (Kind, ItemID)
+    ) WITHOUT ROWID''',
+    '''CREATE TABLE IF NOT EXISTS ReportPaymentMethods (
+        PaymentMethod TEXT PRIMARY KEY,
+        Payments INTEGER NOT NULL DEFAULT 0,
+        Amount REAL NOT NULL DEFAULT 0
+    ) WITHOUT ROWID''',
+]
+
+# Booking column and the table that names its item, per kind
+ITEMS = {
+    "flight": ("FlightID", "FlightInfo", "Airline"),
+    "hotel": ("HotelID", "HotelInfo", "HotelName"),
+    "car": ("CarID", "CarsInfo", "CarType"),
+}
+GROUPINGS = {"airline": "flight", "hotel": "hotel", "car_type": "car"}
+
+EXPORT_TABLES = ("Booking", "Payment")
+EXPORT_FORMATS = ("parquet", "arrow")
+EXPORT_BATCH = 50000
+
+
+def _daily(day, bookings, payments, revenue):
+    return f'''INSERT INTO ReportDaily (Day, Bookings, Payments, Revenue) VALUES ({day}, {bookings}, {payments}, {revenue})
+                ON CONFLICT (Day) DO UPDATE SET Bookings = Bookings + excluded.Bookings,
+                    Payments = Payments + excluded.Payments, Revenue = Revenue + excluded.Revenue;'''
+
+
+def _items(row, sign):
+    return "\n".join(f'''INSERT INTO ReportItems (Kind, ItemID, Bookings) VALUES ('{kind}', {row}.{column}, {sign})
+                ON CONFLICT (Kind, ItemID) DO UPDATE SET Bookings = Bookings + excluded.Bookings;'''
+                     for kind, (column, _, _) in ITEMS.items())
+
+
+def _method(row, sign):
+    return f'''INSERT INTO ReportPaymentMethods (PaymentMethod, Payments, Amount) VALUES ({row}.PaymentMethod, {sign}, {sign} * {row}.Amount)
+                ON CONFLICT (PaymentMethod) DO UPDATE SET Payments = Payments + excluded.Payments,
+                    Amount = Amount + excluded.Amount;'''
+
+
+def _booking_change(row, sign):
+    return _daily(f"{row}.BookingDate", sign, 0, 0) + "\n" + _items(row, sign)
+
+
+def _payment_change(row, sign):
+    return _daily(f"{row}.TransactionDate", 0, sign, f"{sign} * {row}.Amount") + "\n" + _method(row, sign)
+
+
+# (name, event, body). An update counts as taking the old row out and putting the new one in.
+TRIGGERS = [
+    ("trg_booking_insert_report", "INSERT ON Booking", _booking_change("NEW", 1)),
+    ("trg_booking_delete_report", "DELETE ON Booking", _booking_change("OLD", -1)),
+    ("trg_booking_update_report", "UPDATE OF FlightID, HotelID, CarID, BookingDate ON Booking",
+     _booking_change("OLD", -1) + "\n" + _booking_change("NEW", 1)),
+    ("trg_payment_insert_report", "INSERT ON Payment", _payment_change("NEW", 1)),
+    ("trg_payment_delete_report", "DELETE ON Payment", _payment_change("OLD", -1)),
+    ("trg_payment_update_report", "UPDATE OF Amount, PaymentMethod, TransactionDate ON Payment",
+     _payment_change("OLD", -1) + "\n" + _payment_change("NEW", 1)),
+]
+
+
+def create(conn):
+    for table in AGGREGATE_TABLES:
+        conn.execute(table)
+    for name, event, body in TRIGGERS:
+        conn.execute(f"CREATE TRIGGER IF NOT EXISTS {name} AFTER {event} BEGIN\n{body}\nEND")
+
+
+def rebuild(conn):
+    # Recomputes every aggregate from Booking and Payment. The triggers keep them
+    # current, so this is for the migration that adds them and for repairs.
+    for table in ("ReportDaily", "ReportItems", "ReportPaymentMethods"):
+        conn.execute(f"DELETE FROM {table}")
+    conn.execute('''
+        INSERT INTO ReportDaily (Day, Bookings, Payments, Revenue)
+        SELECT Day, SUM(Bookings), SUM(Payments), SUM(Revenue) FROM (
+            SELECT BookingDate AS Day, COUNT(*) AS Bookings, 0 AS Payments, 0 AS Revenue FROM Booking GROUP BY BookingDate
+            UNION ALL
+            SELECT TransactionDate, 0, COUNT(*), SUM(Amount) FROM Payment GROUP BY TransactionDate
+        ) GROUP BY Day
+    ''')
+    for kind, (column, _, _) in ITEMS.items():
+        conn.execute(f"INSERT INTO ReportItems (Kind, ItemID, Bookings) SELECT ?, {column}, COUNT(*) FROM Booking GROUP BY {column}",
+                     (kind,))
+    conn.execute('''
+        INSERT INTO ReportPaymentMethods (PaymentMethod, Payments, Amount)
+        SELECT PaymentMethod, COUNT(*), SUM(Amount) FROM Payment GROUP BY PaymentMethod
+    ''')
+
+
+def _merged(sql, params=()):
+    # {first column: summed remaining columns} over the catalog, or over every
+    # shard when sharded, since each shard keeps aggregates for its own rows
+    totals = {}
+    for pool in shards.pools():
+        with pool.connection() as conn:
+            for key, *values in conn.execute(sql, params):
+                current = totals.get(key)
+                totals[key] = values if current is None else [a + b for a, b in zip(current, values)]
+    return totals
+
+
+def revenue_by_day(start=None, end=None):
+    # [(day, bookings, payments, revenue)] for days with any activity, oldest first
+    rows = _merged('''
+        SELECT Day, Bookings, Payments, Revenue FROM ReportDaily
+        WHERE Day BETWEEN ? AND ? AND (Bookings != 0 OR Payments != 0)
+    ''', (start or "", end or "9999-12-31"))
+    return [(day, bookings, payments, round(revenue, 2)) for day, (bookings, payments, revenue) in sorted(rows.items())]
+
+
+def bookings_by(grouping):
+    # [(name, bookings)] for grouping "airline", "hotel" or "car_type", most booked first
+    if grouping not in GROUPINGS:
+        raise ValueError(f"grouping must be one of: {', '.join(GROUPINGS)}")
+    kind = GROUPINGS[grouping]
+    id_column, info, name = ITEMS[kind]
+    rows = _merged(f'''
+        SELECT {info}.{name}, SUM(ReportItems.Bookings)
+        FROM ReportItems JOIN {info} ON {info}.{id_column} = ReportItems.ItemID
+        WHERE ReportItems.Kind = ? AND ReportItems.Bookings != 0
+        GROUP BY {info}.{name}
+    ''', (kind,))
+    return sorted(((item, bookings) for item, (bookings,) in rows.items() if bookings),
+                  key=lambda row: (-row[1], row[0]))
+
+
+def payment_methods():
+    # [(method, payments, net amount)], largest amount first
+    rows = _merged("SELECT PaymentMethod, Payments, Amount FROM ReportPaymentMethods WHERE Payments != 0")
+    return sorted(((method, payments, round(amount, 2)) for method, (payments, amount) in rows.items() if payments),
+                  key=lambda row: -row[2])
+
+
+def connect_readonly(path):
+    # Opened read-only, so an export can never take the write lock; under WAL it
+    # reads a consistent snapshot while bookings keep committing
+    return sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+
+
+def _pyarrow():
+    global pa
+    if pa is None:
+        try:
+            import pyarrow
+            import pyarrow.ipc
+            import pyarrow.parquet
+        except ImportError:
+            raise RuntimeError("exporting needs pyarrow")
+        pa = pyarrow
+    return pa
+
+
+def _schema(conn, table):
+    # Arrow types from the declared column types, so every batch of a file agrees
+    # even when a batch holds only NULLs or whole numbers in a DECIMAL column
+    fields = []
+    for _, name, declared, _, _, _ in conn.execute(f"PRAGMA table_info({table})"):
+        declared = declared.upper()
+        kind = (pa.int64() if "INT" in declared else
+                pa.float64() if any(word in declared for word in ("REAL", "DEC", "NUM", "FLOA", "DOUB")) else
+                pa.string())
+        fields.append(pa.field(name, kind))
+    return pa.schema(fields)
+
+
+def export(path, out_dir, fmt="parquet", tables=EXPORT_TABLES, batch_size=EXPORT_BATCH, shard_count=None):
+    # Writes each table to <out_dir>/<table>.parquet (or .arrow), streaming in
+    # batches so memory stays flat however large the table is. When sharded the
+    # rows of every shard file go into the same output file. Returns {table: rows}.
+    _pyarrow()
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"format must be one of: {', '.join(EXPORT_FORMATS)}")
+    shard_count = shards.SHARDS if shard_count is None else shard_count
+    os.makedirs(out_dir, exist_ok=True)
+    conns = [connect_readonly(source) for source in (shards.shard_paths(path, shard_count) if shard_count else [path])]
+    counts = {}
+    try:
+        # One read transaction per file for every table, so Booking and Payment agree
+        for conn in conns:
+            conn.execute("BEGIN")
+        for table in tables:
+            schema = _schema(conns[0], table)
+            target = os.path.join(out_dir, f"{table}.{fmt}")
+            writer = pa.parquet.ParquetWriter(target, schema) if fmt == "parquet" else pa.ipc.new_file(target, schema)
+            counts[table] = 0
+            with writer:
+                for conn in conns:
+                    cursor = conn.execute(f"SELECT {', '.join(schema.names)} FROM {table} ORDER BY rowid")
+                    while True:
+                        rows = cursor.fetchmany(batch_size)
+                        if not rows:
+                            break
+                        columns = zip(*rows)
+                        writer.write_batch(pa.record_batch([pa.array(column, field.type) for column, field in zip(columns, schema)],
+                                                           schema=schema))
+                        counts[table] += len(rows)
+        for conn in conns:
+            conn.execute("COMMIT")
+    finally:
+        for conn in conns:
+            conn.close()
+    return counts
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Booking reports and offline exports.")
+    parser.add_argument("command", choices=["summary", "rebuild", "export"])
+    parser.add_argument("--db", default=db.DB_PATH, help="database file (default: %(default)s)")
+    parser.add_argument("--out", default="exports", help="directory for export files (default: %(default)s)")
+    parser.add_argument("--format", choices=EXPORT_FORMATS, default="parquet")
+    parser.add_argument("--shards", type=int, default=shards.SHARDS, help="shard count (default: %(default)s)")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    shards.configure(args.shards)
+    if args.command == "export":
+        for table, count in export(args.db, args.out, args.format, shard_count=args.shards).items():
+            print(f"{table}: {count} rows")
+    elif args.command == "rebuild":
+        db.configure(args.db)
+        for pool in shards.pools():
+            with pool.connection() as conn:
+                rebuild(conn)
+    else:
+        db.configure(args.db)
+        print("Revenue by day (day, bookings, payments, revenue):")
+        for row in revenue_by_day()[-14:]:
+            print(" ", *row)
+        for grouping in GROUPINGS:
+            print(f"Bookings by {grouping}:")
+            for row in bookings_by(grouping)[:10]:
+                print(" ", *row)
+        print("Payment methods (method, payments, amount):")
+        for row in payment_methods():
+            print(" ", *row)
+    print(f"{args.command} took {(time.perf_counter() - start) * 1000:.1f} ms", file=sys.stderr)
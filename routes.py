@@ -0,0 +1,193 @@
+import bisect
+import functools
+import heapq
+import threading
+import time
+from collections import defaultdict, namedtuple
+from datetime import date
+
+import cache
+import db
+
+MAX_STOPS = 2
+ROUTE_LIMIT = 10
+# Shortest and longest connection allowed between two legs, in minutes
+MIN_LAYOVER = 45
+MAX_LAYOVER = 12 * 60
+EPOCH = date(1970, 1, 1).toordinal()
+
+LEG_COLUMNS = ["FlightNo", "Airline", "DeptAirport", "ArrivalAirport", "DeptDate", "DeptTime", "ArrivalDate", "ArrivalTime", "Price"]
+# One flight as kept in memory. departs and arrives are minutes since 1970-01-01 in
+# the airports' local times, as stored; row is the flight in LEG_COLUMNS order.
+Leg = namedtuple("Leg", ["departs", "arrives", "origin", "destination", "price", "row"])
+Itinerary = namedtuple("Itinerary", ["price", "minutes", "stops", "legs"])
+
+SORT_KEYS = {
+    "price": lambda itinerary: (itinerary.price, itinerary.minutes),
+    "duration": lambda itinerary: (itinerary.minutes, itinerary.price),
+}
+
+
+LEGS_SQL = '''
+    SELECT Flights.rowid, FlightNo, Airline, DeptAirport, ArrivalAirport, DeptDate, DeptTime, ArrivalDate, ArrivalTime, Price
+    FROM Flights
+    JOIN FlightInfo ON Flights.FlightID = FlightInfo.FlightID
+    WHERE Flights.rowid > ?
+    ORDER BY Flights.rowid
+'''
+
+
+@functools.lru_cache(maxsize=4096)
+def day_start(date_text):
+    return (date.fromisoformat(date_text).toordinal() - EPOCH) * 1440
+
+
+def _leg(row):
+    # Catalogs span a few hundred distinct dates, so the date parse is cached and
+    # only the HH:MM of each time is converted per flight
+    _, _, _, origin, destination, dept_date, dept_time, arrival_date, arrival_time, price = row
+    try:
+        departs = day_start(dept_date) + int(dept_time[:2]) * 60 + int(dept_time[3:5])
+        arrives = day_start(arrival_date) + int(arrival_time[:2]) * 60 + int(arrival_time[3:5])
+    except (TypeError, ValueError):
+        return None
+    return Leg(departs, arrives, origin, destination, price, tuple(row[1:]))
+
+
+def _index(legs, key):
+    # {key: (departure minutes, legs)}, both sorted by departure, for bisecting
+    grouped = defaultdict(list)
+    for leg in legs:
+        grouped[key(leg)].append(leg)
+    index = {}
+    for name, group in grouped.items():
+        group.sort(key=lambda leg: leg.departs)
+        index[name] = ([leg.departs for leg in group], group)
+    return index
+
+
+def _merge(index, legs, key):
+    # Copy-on-write: only the lists the new legs belong to are rebuilt, and searches
+    # running meanwhile keep reading the old ones
+    merged = dict(index)
+    for name, group in _index(legs, key).items():
+        if name in merged:
+            group = sorted(merged[name][1] + group[1], key=lambda leg: leg.departs)
+            merged[name] = ([leg.departs for leg in group], group)
+        else:
+            merged[name] = group
+    return merged
+
+
+def _by_airport(leg):
+    return leg.origin
+
+def _by_route(leg):
+    return leg.origin, leg.destination
+
+
+class RouteGraph:
+    # Every flight in memory, indexed by departure airport and by (origin,
+    # destination) pair, each sorted by departure time. Kept current from the
+    # Flights change counter: appended flights are merged in, anything else rebuilds.
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.by_airport = {}
+        self.by_route = {}
+        self._path = None
+        self._version = None
+        self._last_row = 0
+        self._count = 0
+        self._stats = {"legs": 0, "full_builds": 0, "incremental_updates": 0, "last_build_seconds": 0.0}
+
+    def refresh(self):
+        pool = db.get_pool()
+        version = cache.catalog_versions.current(("Flights",))[0]
+        if pool.path == self._path and version == self._version:
+            return
+        if pool.path == self._path:
+            # Already built for this database: while another thread reloads, keep
+            # answering from the current graph instead of waiting for it
+            if not self._lock.acquire(blocking=False):
+                return
+        else:
+            self._lock.acquire()
+        try:
+            if pool.path != self._path or version != self._version:
+                self._load(pool)
+        finally:
+            self._lock.release()
+
+    def _load(self, pool):
+        start = time.perf_counter()
+        known = pool.path == self._path and self._version is not None
+        with pool.connection() as conn:
+            version = cache.read_versions(conn).get("Flights", 0)
+            count = conn.execute("SELECT COUNT(*) FROM Flights").fetchone()[0]
+            rows = conn.execute(LEGS_SQL, (self._last_row if known else 0,)).fetchall()
+            # Each insert bumps the counter once and gets a higher rowid, so when the
+            # new rows account for the whole change nothing else was touched
+            incremental = known and version - self._version == len(rows) and count == self._count + len(rows)
+            if known and not incremental:
+                rows = conn.execute(LEGS_SQL, (0,)).fetchall()
+        legs = [leg for leg in map(_leg, rows) if leg is not None]
+        if incremental:
+            by_airport, by_route = _merge(self.by_airport, legs, _by_airport), _merge(self.by_route, legs, _by_route)
+            self._stats["incremental_updates"] += 1
+        else:
+            by_airport, by_route = _index(legs, _by_airport), _index(legs, _by_route)
+            self._stats["full_builds"] += 1
+        self.by_airport, self.by_route = by_airport, by_route
+        self._path, self._version, self._count = pool.path, version, count
+        self._last_row = rows[-1][0] if rows else self._last_row
+        self._stats["legs"] = sum(len(entry[1]) for entry in by_airport.values())
+        self._stats["last_build_seconds"] = time.perf_counter() - start
+
+    def search(self, origin, destination, dept_date, max_stops=MAX_STOPS, sort="price", limit=ROUTE_LIMIT,
+               min_layover=MIN_LAYOVER, max_layover=MAX_LAYOVER):
+        # Itineraries leaving origin on dept_date with up to max_stops connections,
+        # each connection between min_layover and max_layover minutes and never
+        # passing through the same airport twice
+        if sort not in SORT_KEYS:
+            raise ValueError(f"sort must be one of: {', '.join(SORT_KEYS)}")
+        by_airport, by_route = self.by_airport, self.by_route
+        start = day_start(dept_date)
+
+        def departing(index, key, earliest, latest):
+            entry = index.get(key)
+            if entry is None:
+                return ()
+            departs, legs = entry
+            return legs[bisect.bisect_left(departs, earliest):bisect.bisect_right(departs, latest)]
+
+        found = [(leg,) for leg in departing(by_route, (origin, destination), start, start + 1439)]
+        if max_stops >= 1:
+            for first in departing(by_airport, origin, start, start + 1439):
+                if first.destination == destination:
+                    continue
+                earliest, latest = first.arrives + min_layover, first.arrives + max_layover
+                for second in departing(by_route, (first.destination, destination), earliest, latest):
+                    found.append((first, second))
+                if max_stops < 2:
+                    continue
+                for second in departing(by_airport, first.destination, earliest, latest):
+                    if second.destination in (origin, destination):
+                        continue
+                    for third in departing(by_route, (second.destination, destination),
+                                           second.arrives + min_layover, second.arrives + max_layover):
+                        found.append((first, second, third))
+
+        itineraries = (Itinerary(round(sum(leg.price for leg in legs), 2), legs[-1].arrives - legs[0].departs,
+                                 len(legs) - 1, [leg.row for leg in legs]) for legs in found)
+        return heapq.nsmallest(limit, itineraries, key=SORT_KEYS[sort])
+
+    def stats(self):
+        return dict(self._stats)
+
+
+graph = RouteGraph()
+
+
+def search_routes(origin, destination, dept_date, max_stops=MAX_STOPS, sort="price", limit=ROUTE_LIMIT):
+    graph.refresh()
+    return graph.search(origin, destination, dept_date, max(0, min(max_stops, MAX_STOPS)), sort, limit)
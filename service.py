@@ -0,0 +1,319 @@
+import base64
+import functools
+import json
+from datetime import datetime
+
+import availability
+import bookings
+import cache
+import columnar
+import db
+import notifications
+import passwords
+import pricing
+import routes
+import shards
+import tracing
+
+FLIGHT_COLUMNS = ["FlightNo", "Airline", "DeptDate", "DeptTime", "ArrivalDate", "ArrivalTime", "Price"]
+HOTEL_COLUMNS = ["HotelName", "Address", "Price", "Rating"]
+CAR_COLUMNS = ["PickupTime", "RentalCompany", "IsAvailable", "Price", "DropLocation", "DropDate", "DropTime"]
+BOOKING_COLUMNS = ["BookingID", "HotelName", "CarType", "TotalAmt"]
+PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+
+BookingNotFound = bookings.BookingNotFound
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+# Searches filter on per-day capacity, so their cached results go stale on bookings too
+HOTEL_TABLES = ("Hotels", availability.KINDS["hotel"].availability)
+CAR_TABLES = ("Cars", availability.KINDS["car"].availability)
+
+
+def encode_cursor(key):
+    return base64.urlsafe_b64encode(json.dumps(list(key)).encode('utf-8')).decode('ascii')
+
+def decode_cursor(token, width):
+    try:
+        key = json.loads(base64.urlsafe_b64decode(token.encode('ascii')))
+    except (ValueError, TypeError):
+        raise InvalidCursor(token)
+    if not isinstance(key, list) or len(key) != width:
+        raise InvalidCursor(token)
+    # Only values SQLite can bind; JSON objects and arrays would fail at execute
+    if not all(value is None or isinstance(value, (str, int, float)) for value in key):
+        raise InvalidCursor(token)
+    return key
+
+def keyset_page(select, where, order, params, after, limit, connection=db.connection):
+    # Rows come back ordered by the `order` columns, which are selected last and
+    # form the cursor. One extra row is fetched to learn whether another page exists.
+    limit = max(1, min(int(limit), MAX_PAGE_SIZE))
+    width = len(order)
+    params = list(params)
+    if after:
+        where += f" AND ({', '.join(order)}) > ({', '.join('?' * width)})"
+        params += decode_cursor(after, width)
+    sql = f"SELECT {select}, {', '.join(order)} {where} ORDER BY {', '.join(order)} LIMIT ?"
+    with connection() as conn:
+        rows = conn.execute(sql, params + [limit + 1]).fetchall()
+    next_cursor = encode_cursor(tuple(rows[limit - 1])[-width:]) if len(rows) > limit else None
+    return [tuple(row)[:-width] for row in rows[:limit]], next_cursor
+
+def snapshot_page(search, args, width, after, limit):
+    # keyset_page for the columnar engine: the same order, so cursors from either
+    # engine work with the other
+    limit = max(1, min(int(limit), MAX_PAGE_SIZE))
+    rows, next_key = search(*args, decode_cursor(after, width) if after else None, limit)
+    return rows, encode_cursor(next_key) if next_key is not None else None
+
+
+def hash_password(password):
+    return passwords.hash_password(password)
+
+def create_user(username, password, email, phone_no):
+    hashed_password = hash_password(password)
+    current_date = datetime.now().strftime('%Y-%m-%d')
+    current_time = datetime.now().strftime('%H:%M:%S')
+    if not shards.enabled():
+        with db.connection() as conn:
+            cursor = conn.execute("INSERT INTO Users (Username, Password, Email, PhoneNo, CDate, CTime) VALUES (?, ?, ?, ?, ?, ?)",
+                                  (username, hashed_password, email, phone_no, current_date, current_time))
+        return cursor.lastrowid
+    # The catalog's directory claims the username and hands out the ID, which picks the shard
+    user_id = shards.register_user(username)
+    try:
+        with shards.connection(user_id) as conn:
+            conn.execute("INSERT INTO Users (UserID, Username, Password, Email, PhoneNo, CDate, CTime) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                         (user_id, username, hashed_password, email, phone_no, current_date, current_time))
+    except BaseException:
+        shards.unregister_user(username)
+        raise
+    return user_id
+
+def find_user(username):
+    if not shards.enabled():
+        with db.connection() as conn:
+            return conn.execute("SELECT * FROM Users WHERE Username = ?", (username,)).fetchone()
+    user_id = shards.find_user_id(username)
+    if user_id is None:
+        return None
+    with shards.connection(user_id) as conn:
+        return conn.execute("SELECT * FROM Users WHERE UserID = ?", (user_id,)).fetchone()
+
+def get_user(user_id):
+    with shards.connection(user_id) as conn:
+        return conn.execute("SELECT * FROM Users WHERE UserID = ?", (user_id,)).fetchone()
+
+def login_user(username, password, client=None):
+    # client is the caller's address, for the per-client rate limit; the hash is
+    # checked with no pooled connection held
+    passwords.check_login(username, client)
+    user = find_user(username)
+    ok, needs_rehash = passwords.verify_password(password, user['Password'] if user else None)
+    passwords.record_login(username, ok)
+    if not ok:
+        return None, None
+    if needs_rehash:
+        # Upgrade legacy or weaker hashes now that we know the password. Matching the
+        # old hash keeps a password change made meanwhile from being overwritten.
+        rehashed = hash_password(password)
+        with shards.connection(user['UserID']) as conn:
+            conn.execute("UPDATE Users SET Password = ? WHERE UserID = ? AND Password = ?",
+                         (rehashed, user['UserID'], user['Password']))
+    return user, user['UserId']
+
+def load_airports():
+    with db.connection() as conn:
+        rows = conn.execute("SELECT DISTINCT DeptAirport AS Airport FROM Flights UNION SELECT DISTINCT ArrivalAirport AS Airport FROM Flights").fetchall()
+    return [row['Airport'] for row in rows]
+
+def get_airports():
+    return cache.lookups.get("airports", ("Flights",), load_airports)
+
+
+def load_hotels_locations():
+    with db.connection() as conn:
+        rows = conn.execute("SELECT DISTINCT Address FROM Hotels").fetchall()
+    return [row['Address'] for row in rows]
+
+def get_hotels_locations():
+    return cache.lookups.get("hotel_locations", ("Hotels",), load_hotels_locations)
+
+
+def load_car_pickup_locations():
+    with db.connection() as conn:
+        rows = conn.execute("SELECT DISTINCT PickupLocation FROM Cars").fetchall()
+    return [row['PickupLocation'] for row in rows]
+
+def get_car_pickup_locations():
+    return cache.lookups.get("car_pickup_locations", ("Cars",), load_car_pickup_locations)
+
+
+def load_rentable_car_types():
+    # Car types with a listing that is ever for rent; IsAvailable = 'No' listings have no capacity
+    with db.connection() as conn:
+        rows = conn.execute('''
+            SELECT CarType FROM CarsInfo
+            WHERE EXISTS (SELECT 1 FROM Cars WHERE Cars.CarID = CarsInfo.CarID AND IsAvailable != 'No')
+            ORDER BY CarID
+        ''').fetchall()
+    return [row['CarType'] for row in rows]
+
+def get_rentable_car_types():
+    return cache.lookups.get("rentable_car_types", ("Cars",), load_rentable_car_types)
+
+
+def query_flights(dept_airport, arrival_airport, dept_date):
+    if columnar.enabled():
+        return columnar.search_flights(dept_airport, arrival_airport, dept_date)
+    with db.connection() as conn:
+        return conn.execute('''
+            SELECT Flights.FlightNo, FlightInfo.Airline, Flights.DeptDate, Flights.DeptTime,
+                   Flights.ArrivalDate, Flights.ArrivalTime, Flights.Price
+            FROM Flights
+            JOIN FlightInfo ON Flights.FlightID = FlightInfo.FlightID
+            WHERE Flights.DeptAirport = ? AND Flights.ArrivalAirport = ? AND Flights.DeptDate = ?
+        ''', (dept_airport, arrival_airport, dept_date)).fetchall()
+
+def search_flights(dept_airport, arrival_airport, dept_date):
+    return cache.cached_search("flights", ("Flights",), (dept_airport, arrival_airport, dept_date), query_flights)
+
+
+def query_hotels(location, entry_date, exit_date):
+    # Listings at the location with a room free on every night of the stay
+    if columnar.enabled():
+        return columnar.search_hotels(location, entry_date, exit_date)
+    days = availability.hotel_days(entry_date, exit_date)
+    if days[1] < days[0]:
+        return []
+    with db.connection() as conn:
+        return conn.execute('''
+            SELECT HotelInfo.HotelName, Hotels.Address, Hotels.Price, Hotels.Rating
+            FROM Hotels
+            JOIN HotelInfo ON Hotels.HotelID = HotelInfo.HotelID
+            WHERE Hotels.Address = ? AND ''' + availability.available_sql("hotel", "Hotels.rowid"),
+            (location,) + availability.available_params(days)).fetchall()
+
+def search_hotels(location, entry_date, exit_date):
+    return cache.cached_search("hotels", HOTEL_TABLES, (location, entry_date, exit_date), query_hotels)
+
+
+def query_cars(location, pickup_date, drop_date):
+    # Cars picked up at the location that are free from the pickup day through the drop day
+    if columnar.enabled():
+        return columnar.search_cars(location, pickup_date, drop_date)
+    days = availability.car_days(pickup_date, drop_date)
+    if days[1] < days[0]:
+        return []
+    with db.connection() as conn:
+        return conn.execute('''
+            SELECT PickupTime, RentalCompany, IsAvailable, Price, DropLocation, DropDate, DropTime FROM Cars
+            WHERE PickupLocation = ? AND ''' + availability.available_sql("car", "Cars.rowid"),
+            (location,) + availability.available_params(days)).fetchall()
+
+def search_cars(location, pickup_date, drop_date):
+    return cache.cached_search("cars", CAR_TABLES, (location, pickup_date, drop_date), query_cars)
+
+
+def query_flights_page(dept_airport, arrival_airport, dept_date, after, limit):
+    if columnar.enabled():
+        return snapshot_page(columnar.search_flights_page, (dept_airport, arrival_airport, dept_date), 3, after, limit)
+    return keyset_page(
+        "Flights.FlightNo, FlightInfo.Airline, Flights.DeptDate, Flights.DeptTime, Flights.ArrivalDate, Flights.ArrivalTime, Flights.Price",
+        "FROM Flights JOIN FlightInfo ON Flights.FlightID = FlightInfo.FlightID"
+        " WHERE Flights.DeptAirport = ? AND Flights.ArrivalAirport = ? AND Flights.DeptDate = ?",
+        ["Flights.Price", "Flights.DeptTime", "Flights.rowid"],
+        (dept_airport, arrival_airport, dept_date), after, limit)
+
+def search_flights_page(dept_airport, arrival_airport, dept_date, after=None, limit=PAGE_SIZE):
+    return cache.searches.get(("flights_page", dept_airport, arrival_airport, dept_date, after, limit), ("Flights",),
+                              lambda: query_flights_page(dept_airport, arrival_airport, dept_date, after, limit))
+
+
+def query_hotels_page(location, entry_date, exit_date, after, limit):
+    if columnar.enabled():
+        return snapshot_page(columnar.search_hotels_page, (location, entry_date, exit_date), 2, after, limit)
+    days = availability.hotel_days(entry_date, exit_date)
+    if days[1] < days[0]:
+        return [], None
+    return keyset_page(
+        "HotelInfo.HotelName, Hotels.Address, Hotels.Price, Hotels.Rating",
+        "FROM Hotels JOIN HotelInfo ON Hotels.HotelID = HotelInfo.HotelID"
+        " WHERE Hotels.Address = ? AND " + availability.available_sql("hotel", "Hotels.rowid"),
+        ["Hotels.Price", "Hotels.rowid"],
+        (location,) + availability.available_params(days), after, limit)
+
+def search_hotels_page(location, entry_date, exit_date, after=None, limit=PAGE_SIZE):
+    return cache.searches.get(("hotels_page", location, entry_date, exit_date, after, limit), HOTEL_TABLES,
+                              lambda: query_hotels_page(location, entry_date, exit_date, after, limit))
+
+
+def query_cars_page(location, pickup_date, drop_date, after, limit):
+    if columnar.enabled():
+        return snapshot_page(columnar.search_cars_page, (location, pickup_date, drop_date), 3, after, limit)
+    days = availability.car_days(pickup_date, drop_date)
+    if days[1] < days[0]:
+        return [], None
+    return keyset_page(
+        "PickupTime, RentalCompany, IsAvailable, Price, DropLocation, DropDate, DropTime",
+        "FROM Cars WHERE PickupLocation = ? AND " + availability.available_sql("car", "Cars.rowid"),
+        ["Price", "PickupTime", "rowid"],
+        (location,) + availability.available_params(days), after, limit)
+
+def search_cars_page(location, pickup_date, drop_date, after=None, limit=PAGE_SIZE):
+    return cache.searches.get(("cars_page", location, pickup_date, drop_date, after, limit), CAR_TABLES,
+                              lambda: query_cars_page(location, pickup_date, drop_date, after, limit))
+
+
+def quote(flight_name, hotel_name, car_name):
+    return pricing.quote(flight_name, hotel_name, car_name)
+
+def get_total_price(car_name, house_name, flight_name):
+    return pricing.quote(flight_name, house_name, car_name).total
+
+
+def list_bookings_page(user_id, after=None, limit=PAGE_SIZE):
+    return keyset_page(
+        "Booking.BookingID, HotelInfo.HotelName, CarsInfo.CarType, Booking.TotalAmt",
+        "FROM Booking JOIN HotelInfo ON Booking.HotelID = HotelInfo.HotelID"
+        " JOIN CarsInfo ON Booking.CarID = CarsInfo.CarID WHERE Booking.UserID = ?",
+        ["Booking.BookingID"],
+        (user_id,), after, limit, functools.partial(shards.connection, user_id))
+
+def get_booking(booking_id, user_id):
+    with shards.connection(user_id) as conn:
+        return conn.execute('''
+            SELECT FlightID, HotelID, CarID FROM Booking WHERE BookingID = ? AND UserID = ?
+        ''', (booking_id, user_id)).fetchone()
+
+def book(user_id, flight_name, hotel_name, car_name, stay=None, rental=None):
+    # Quote, capacity, Booking, Payment and Notifications rows commit together
+    # (when sharded, capacity commits in the catalog just before the shard does)
+    return bookings.book(user_id, flight_name, hotel_name, car_name, stay, rental)
+
+def modify_booking(booking_id, user_id, flight_name, hotel_name, car_name, stay=None, rental=None):
+    return bookings.modify(booking_id, user_id, flight_name, hotel_name, car_name, stay, rental)
+
+def cancel_booking(booking_id, user_id):
+    return bookings.cancel(booking_id, user_id)
+
+
+def stats():
+    stats = cache.cache_stats()
+    stats["pool"] = db.pool_stats()
+    stats["queries"] = tracing.tracer.snapshot()
+    stats["routes"] = routes.graph.stats()
+    stats["passwords"] = passwords.stats()
+    stats["notifications"] = notifications.stats()
+    stats["bookings"] = bookings.stats()
+    if shards.enabled():
+        stats["shards"] = shards.stats()
+    if columnar.enabled():
+        stats["columnar"] = columnar.stats()
+    return stats
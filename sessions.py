@@ -0,0 +1,39 @@
+import hashlib
+import hmac
+import os
+import time
+
+# Session tokens for the JSON API: "<user id>.<expiry>.<signature>", signed with
+# SECRET so any process sharing it can check a token without a lookup. Without
+# TRAVEL_BOOKING_SESSION_SECRET a random secret is used and tokens last only
+# as long as the process.
+SECRET = os.environ.get('TRAVEL_BOOKING_SESSION_SECRET', '').encode() or os.urandom(32)
+TTL = 12 * 3600
+# Usernames allowed to see the Admin page and the admin API routes (queries, pool
+# internals and revenue), comma separated; nobody by default
+ADMINS = {name.strip() for name in os.environ.get('TRAVEL_BOOKING_ADMINS', '').split(',') if name.strip()}
+
+
+def _sign(payload):
+    return hmac.new(SECRET, payload.encode(), hashlib.sha256).hexdigest()
+
+
+def issue(user_id, ttl=TTL):
+    payload = f"{int(user_id)}.{int(time.time() + ttl)}"
+    return f"{payload}.{_sign(payload)}"
+
+
+def user_id(token):
+    # The UserID a token was issued for, or None if it is malformed, forged or expired
+    try:
+        user, expires, signature = token.split(".")
+        user, expires = int(user), int(expires)
+    except (AttributeError, ValueError):
+        return None
+    if not hmac.compare_digest(signature, _sign(f"{user}.{expires}")) or expires < time.time():
+        return None
+    return user
+
+
+def is_admin(username):
+    return username in ADMINS
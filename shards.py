@@ -0,0 +1,246 @@
+import argparse
+import os
+import sqlite3
+import sys
+import threading
+import time
+import zlib
+
+import availability
+import db
+import migrations
+
+# With SHARDS > 0, Users, Booking, Payment and Notifications are spread over that
+# many shard files by a hash of the UserID, and each shard takes writes
+# independently. Flights, hotels, cars, availability and the ID sequences stay in
+# the catalog database, so every booking write still takes the catalog's write
+# lock for its capacity change. The catalog (the configured DB_PATH) is attached
+# read-only to every shard connection so bookings can still be joined to hotel and
+# car names.
+SHARDS = int(os.environ.get('TRAVEL_BOOKING_SHARDS', 0))
+MOVE_BATCH = 1000
+
+
+def shard_paths(catalog, count):
+    stem, ext = os.path.splitext(catalog)
+    return [f"{stem}.shard{index}{ext or '.db'}" for index in range(count)]
+
+
+def shard_of(user_id, count):
+    # Stable across processes and Python versions, unlike hash()
+    return zlib.crc32(str(int(user_id)).encode()) % count
+
+
+class ShardRouter:
+    def __init__(self, catalog, count, **pool_options):
+        self.catalog = catalog
+        self.paths = shard_paths(catalog, count)
+        self.pools = []
+        for path in self.paths:
+            pool = db.ConnectionPool(path, attach={"catalog": catalog}, **pool_options)
+            with pool.connection() as conn:
+                migrations.migrate(conn, steps=migrations.SHARD_MIGRATIONS)
+            self.pools.append(pool)
+
+    def pool(self, user_id):
+        return self.pools[shard_of(user_id, len(self.pools))]
+
+    def close(self):
+        for pool in self.pools:
+            pool.close_all()
+
+
+_router = None
+_lock = threading.Lock()
+
+
+def configure(count):
+    global SHARDS, _router
+    with _lock:
+        if _router is not None:
+            _router.close()
+        SHARDS, _router = count, None
+
+
+def enabled():
+    return SHARDS > 0
+
+
+def router():
+    # Built on first use for the current catalog database, and rebuilt if db.configure
+    # points somewhere else
+    global _router
+    catalog = db.get_pool()
+    current = _router
+    if current is None or current.catalog != catalog.path:
+        with _lock:
+            if _router is None or _router.catalog != catalog.path:
+                if _router is not None:
+                    _router.close()
+                _router = ShardRouter(catalog.path, SHARDS, max_size=catalog.max_size)
+            current = _router
+    return current
+
+
+def pool_for(user_id):
+    return router().pool(user_id) if enabled() else db.get_pool()
+
+
+def connection(user_id):
+    # The connection holding this user's rows: their shard, or the catalog when unsharded
+    return pool_for(user_id).connection()
+
+
+def pools():
+    return router().pools if enabled() else [db.get_pool()]
+
+
+def find_user_id(username):
+    with db.connection() as conn:
+        row = conn.execute("SELECT UserID FROM UserDirectory WHERE Username = ?", (username,)).fetchone()
+    return row[0] if row else None
+
+
+def register_user(username):
+    # Claims the username and a new UserID in one catalog write; raises
+    # sqlite3.IntegrityError if the username is taken
+    with db.connection() as conn:
+        user_id = conn.execute(
+            "UPDATE BookingSequence SET NextValue = NextValue + 1 WHERE Name = 'User' RETURNING NextValue - 1"
+        ).fetchone()[0]
+        conn.execute("INSERT INTO UserDirectory (Username, UserID) VALUES (?, ?)", (username, user_id))
+    return user_id
+
+
+def unregister_user(username):
+    with db.connection() as conn:
+        conn.execute("DELETE FROM UserDirectory WHERE Username = ?", (username,))
+
+
+def stats():
+    if not enabled():
+        return {}
+    return {os.path.basename(pool.path): pool.stats() for pool in router().pools}
+
+
+def _open(path, catalog):
+    conn = sqlite3.connect(path, isolation_level=None)
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.execute("PRAGMA busy_timeout = 5000")
+    migrations.migrate(conn, steps=migrations.MIGRATIONS if path == catalog else migrations.SHARD_MIGRATIONS)
+    return conn
+
+
+def _columns(conn, schema, table):
+    return [row[1] for row in conn.execute(f"PRAGMA {schema}.table_info({table})")]
+
+
+def rebalance(catalog, old_count, new_count, batch_size=MOVE_BATCH):
+    # Moves every user's rows from the old layout to the new one; a count of 0 means
+    # the unsharded layout, with everything in the catalog. Only users whose shard
+    # changes are copied. Run it with the app stopped and then start the app with
+    # the new count. Each batch is copied then deleted in one transaction, and
+    # copies replace rather than duplicate, so an interrupted run can be rerun.
+    # Returns {source path: users moved out}.
+    sources = shard_paths(catalog, old_count) if old_count else [catalog]
+    targets = shard_paths(catalog, new_count) if new_count else [catalog]
+    if old_count:
+        _settle_journal(catalog, sources)
+    for path in targets:
+        _open(path, catalog).close()
+    moved = {}
+    for source in sources:
+        if not os.path.exists(source):
+            continue
+        conn = _open(source, catalog)
+        conn.execute("CREATE TEMP TABLE IF NOT EXISTS MovingUsers (UserID INTEGER PRIMARY KEY)")
+        moved[source] = 0
+        user_ids = [row[0] for row in conn.execute("SELECT UserID FROM Users ORDER BY UserID")]
+        by_target = {}
+        for user_id in user_ids:
+            target = targets[shard_of(user_id, new_count)] if new_count else catalog
+            if target != source:
+                by_target.setdefault(target, []).append(user_id)
+        for target, ids in by_target.items():
+            conn.execute("ATTACH DATABASE ? AS target", (target,))
+            try:
+                for start in range(0, len(ids), batch_size):
+                    batch = ids[start:start + batch_size]
+                    conn.execute("BEGIN IMMEDIATE")
+                    try:
+                        conn.execute("DELETE FROM temp.MovingUsers")
+                        conn.executemany("INSERT INTO temp.MovingUsers (UserID) VALUES (?)", [(i,) for i in batch])
+                        for table in migrations.USER_TABLES:
+                            names = ", ".join(_columns(conn, "main", table))
+                            conn.execute(f'''INSERT OR REPLACE INTO target.{table} ({names})
+                                SELECT {names} FROM main.{table} WHERE UserID IN (SELECT UserID FROM temp.MovingUsers)''')
+                            conn.execute(f"DELETE FROM main.{table} WHERE UserID IN (SELECT UserID FROM temp.MovingUsers)")
+                        conn.execute("COMMIT")
+                    except BaseException:
+                        conn.execute("ROLLBACK")
+                        raise
+                    moved[source] += len(batch)
+            finally:
+                conn.execute("DETACH DATABASE target")
+        conn.close()
+    if new_count:
+        _index_users(catalog, targets)
+    return moved
+
+
+def _settle_journal(catalog, paths):
+    # The AppliedCapacity markers that settle the capacity journal stay behind when
+    # users move, so settle it against the old layout first
+    applied = set()
+    for path in paths:
+        if os.path.exists(path):
+            conn = _open(path, catalog)
+            applied.update(row[0] for row in conn.execute("SELECT ChangeID FROM AppliedCapacity"))
+            conn.close()
+    conn = _open(catalog, catalog)
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        change_ids = [row[0] for row in conn.execute("SELECT ChangeID FROM CapacityJournal")]
+        availability.settle(conn, change_ids, applied)
+        conn.execute("COMMIT")
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    conn.close()
+    for path in paths:
+        if os.path.exists(path):
+            conn = _open(path, catalog)
+            conn.execute("DELETE FROM AppliedCapacity")
+            conn.close()
+
+
+def _index_users(catalog, paths):
+    # Points the directory at every user and moves the UserID sequence past them
+    conn = _open(catalog, catalog)
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        highest = 0
+        for path in paths:
+            rows = sqlite3.connect(path).execute("SELECT Username, UserID FROM Users").fetchall()
+            conn.executemany("INSERT OR REPLACE INTO UserDirectory (Username, UserID) VALUES (?, ?)", rows)
+            highest = max([highest] + [user_id for _, user_id in rows])
+        conn.execute("UPDATE BookingSequence SET NextValue = MAX(NextValue, ?) WHERE Name = 'User'", (highest + 1,))
+        conn.execute("COMMIT")
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    conn.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Move user data between shard layouts.")
+    parser.add_argument("--db", default=db.DB_PATH, help="catalog database (default: %(default)s)")
+    parser.add_argument("--from", dest="old", type=int, default=0, help="current shard count, 0 for unsharded (default: %(default)s)")
+    parser.add_argument("--to", dest="new", type=int, required=True, help="new shard count, 0 to merge back into the catalog")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    for source, count in rebalance(args.db, args.old, args.new).items():
+        print(f"{source}: moved {count} users")
+    print(f"Rebalanced in {time.perf_counter() - start:.1f}s; start the app with TRAVEL_BOOKING_SHARDS={args.new}",
+          file=sys.stderr)
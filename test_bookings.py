@@ -0,0 +1,256 @@
+import sqlite3
+import threading
+from concurrent.futures import Future
+
+import pytest
+
+import availability
+import benchmark
+import booking_ids
+import bookings
+import cache
+import create
+import db
+import passwords
+import pricing
+import service
+import shards
+
+ITINERARY = ("Delta", "Grand Hotel", "SUV")
+
+
+@pytest.fixture
+def database(tmp_path):
+    path = str(tmp_path / "test.db")
+    passwords.configure(2 ** 4)
+    benchmark.generate(path, flights=200, hotels=20, cars=20, users=5, bookings=10, days=30)
+    db.configure(path, max_size=4)
+    shards.configure(0)
+    bookings.configure(False)
+    cache.lookups.invalidate()
+    cache.searches.invalidate()
+    yield path
+    shards.configure(0)
+    bookings.configure(False)
+    db.get_pool().close_all()
+
+
+def _capacity(path, kind, item_id, value=None):
+    # Total capacity over every listing and day of the item; with value, first sets
+    # the item's first listing to that capacity and every other listing to 0
+    inventory = availability.KINDS[kind]
+    conn = sqlite3.connect(path)
+    listings = f"SELECT rowid FROM {inventory.table} WHERE {inventory.item_column} = ?"
+    if value is not None:
+        conn.execute(f"UPDATE {inventory.availability} SET Capacity = 0 WHERE ItemRow IN ({listings})", (item_id,))
+        conn.execute(f"UPDATE {inventory.availability} SET Capacity = ? WHERE ItemRow = ({listings} ORDER BY rowid LIMIT 1)",
+                     (value, item_id))
+        conn.commit()
+    total = conn.execute(f"SELECT SUM(Capacity) FROM {inventory.availability} WHERE ItemRow IN ({listings})",
+                         (item_id,)).fetchone()[0]
+    conn.close()
+    return total
+
+
+def _count(path, sql, *params):
+    conn = sqlite3.connect(path)
+    value = conn.execute(sql, params).fetchone()[0]
+    conn.close()
+    return value
+
+
+def test_sold_out_rolls_back(database):
+    quote = pricing.quote_sql(*ITINERARY)
+    _capacity(database, "hotel", quote.hotel_id, 1)
+    car_capacity = _capacity(database, "car", quote.car_id)
+
+    booking_id, _ = service.book(1, *ITINERARY)
+    with pytest.raises(availability.Unavailable):
+        service.book(2, *ITINERARY)
+    # The failed booking left no rows and gave back the car it had taken
+    assert _count(database, "SELECT COUNT(*) FROM Booking WHERE UserID = 2 AND HotelID = ?", quote.hotel_id) == 0
+    assert _capacity(database, "car", quote.car_id) == car_capacity - _count(
+        database, "SELECT LastDay - FirstDay + 1 FROM BookingInventory WHERE BookingID = ? AND Kind = 'car'", booking_id)
+
+    assert service.cancel_booking(booking_id, 1)
+    service.book(2, *ITINERARY)
+
+
+def test_double_cancel_restores_capacity_once(database):
+    quote = pricing.quote_sql(*ITINERARY)
+    before = _capacity(database, "hotel", quote.hotel_id)
+    booking_id, _ = service.book(1, *ITINERARY)
+    assert _capacity(database, "hotel", quote.hotel_id) < before
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(service.cancel_booking(booking_id, 1))) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sorted(results) == [False, False, False, True]
+    assert not service.cancel_booking(booking_id, 1)
+    assert _capacity(database, "hotel", quote.hotel_id) == before
+    assert _count(database, "SELECT COUNT(*) FROM Payment WHERE BookingID = ? AND Amount < 0", booking_id) == 1
+
+
+def test_booking_is_priced_from_the_listing_it_holds(database):
+    quote = pricing.quote_sql(*ITINERARY)
+    conn = sqlite3.connect(database)
+    # Only the hotel's last listing is left, so the booking cannot land on the first
+    row, entry, exit = conn.execute(
+        "SELECT rowid, EntryDate, ExitDate FROM Hotels WHERE HotelID = ? ORDER BY rowid DESC LIMIT 1",
+        (quote.hotel_id,)).fetchone()
+    conn.execute("UPDATE HotelAvailability SET Capacity = 0 WHERE ItemRow IN (SELECT rowid FROM Hotels WHERE HotelID = ?)"
+                 " AND ItemRow != ?", (quote.hotel_id, row))
+    conn.commit()
+
+    booking_id, booking_quote = service.book(1, *ITINERARY, stay=(entry, exit))
+    held = dict(conn.execute("SELECT Kind, ItemRow FROM BookingInventory WHERE BookingID = ?", (booking_id,)))
+    hotel_price = conn.execute("SELECT Price FROM Hotels WHERE rowid = ?", (held["hotel"],)).fetchone()[0]
+    car_price = conn.execute("SELECT Price FROM Cars WHERE rowid = ?", (held["car"],)).fetchone()[0]
+    total = conn.execute("SELECT TotalAmt FROM Booking WHERE BookingID = ?", (booking_id,)).fetchone()[0]
+    conn.close()
+    assert held["hotel"] == row
+    assert booking_quote.hotel_price == hotel_price != quote.hotel_price
+    assert total == pytest.approx(quote.flight_price + hotel_price + car_price)
+
+
+def test_group_commit_isolates_a_failing_write(database):
+    first, second = booking_ids.next_booking_id(), booking_ids.next_booking_id()
+    futures = [Future() for _ in range(3)]
+    batch = [
+        (bookings._book, (first, 1, *ITINERARY, None, None, bookings.PAYMENT_METHOD, []), futures[0]),
+        (bookings._modify, ("B0", 1, *ITINERARY, None, None, []), futures[1]),
+        (bookings._book, (second, 2, *ITINERARY, None, None, bookings.PAYMENT_METHOD, []), futures[2]),
+    ]
+    bookings.GroupCommitter()._commit(batch)
+
+    # Each car listing is one car, so the two bookings hold, and are priced from, different ones
+    assert futures[0].result().hotel_id == futures[2].result().hotel_id
+    with pytest.raises(bookings.BookingNotFound):
+        futures[1].result()
+    assert _count(database, "SELECT COUNT(*) FROM Booking WHERE BookingID IN (?, ?)", first, second) == 2
+    assert bookings.stats()["batches"] >= 1
+
+
+def test_busy_database_is_retried(database):
+    calls = []
+
+    def work(conn):
+        calls.append(1)
+        if len(calls) == 1:
+            raise sqlite3.OperationalError("database is locked")
+        return conn.execute("SELECT COUNT(*) FROM Booking").fetchone()[0]
+
+    retries = bookings.stats()["busy_retries"]
+    assert bookings.run_transaction(work) == 10
+    assert len(calls) == 2
+    assert bookings.stats()["busy_retries"] == retries + 1
+
+
+def test_id_blocks_never_overlap(database):
+    # Two allocators stand in for two processes sharing the database
+    first, second = booking_ids.BookingIdAllocator(block_size=3), booking_ids.BookingIdAllocator(block_size=3)
+    ids = [allocator.next_id() for _ in range(10) for allocator in (first, second)]
+    assert len(set(ids)) == len(ids)
+    assert min(int(booking_id[1:]) for booking_id in ids) > 10
+
+
+def test_seeded_database_allocates_fresh_ids(tmp_path):
+    path = str(tmp_path / "seeded.db")
+    create.create_database(path)
+    db.configure(path, max_size=4)
+    try:
+        booking_id, _ = service.book(1, "Delta", "Grand Hotel", "SUV")
+        assert int(booking_id[1:]) > 789
+        assert _count(path, "SELECT NextValue FROM BookingSequence WHERE Name = 'User'") == 6
+    finally:
+        db.get_pool().close_all()
+
+
+def _shard(path, count):
+    db.get_pool().close_all()
+    shards.rebalance(path, 0, count)
+    shards.configure(count)
+    db.configure(path, max_size=4)
+
+
+def test_failed_post_commit_hook_keeps_the_booking(database, monkeypatch):
+    _shard(database, 2)
+    quote = pricing.quote_sql(*ITINERARY)
+    before = _capacity(database, "hotel", quote.hotel_id)
+
+    def broken(tables):
+        raise db.PoolTimeout()
+
+    monkeypatch.setattr(cache, "invalidate_catalog", broken)
+    booking_id, _ = service.book(1, *ITINERARY)
+    assert service.get_booking(booking_id, 1) is not None
+    assert _capacity(database, "hotel", quote.hotel_id) == before - _count(
+        database, "SELECT LastDay - FirstDay + 1 FROM BookingInventory WHERE BookingID = ? AND Kind = 'hotel'", booking_id)
+    # The journal keeps the committed change
+    assert bookings.reconcile() == 0
+    assert _count(database, "SELECT COUNT(*) FROM CapacityJournal") == 0
+    assert _capacity(database, "hotel", quote.hotel_id) < before
+
+
+def test_reconcile_undoes_a_change_whose_shard_write_never_committed(database):
+    _shard(database, 2)
+    quote = pricing.quote_sql(*ITINERARY)
+    before = _capacity(database, "hotel", quote.hotel_id)
+    booking_id, _ = service.book(1, *ITINERARY)
+    held = _capacity(database, "hotel", quote.hotel_id)
+
+    def crash(conn, *args):
+        # The catalog commits the cancel's release, then the process dies before the shard commits
+        bookings._cancel(conn, *args)
+        raise SystemExit
+
+    with pytest.raises(SystemExit):
+        bookings._submit(1, crash, booking_id, 1, [])
+    assert _capacity(database, "hotel", quote.hotel_id) == before
+    assert service.get_booking(booking_id, 1) is not None
+
+    assert bookings.reconcile() == 1
+    assert _capacity(database, "hotel", quote.hotel_id) == held
+    assert _count(database, "SELECT COUNT(*) FROM CapacityJournal") == 0
+    assert service.cancel_booking(booking_id, 1)
+    assert _capacity(database, "hotel", quote.hotel_id) == before
+
+
+def _user_rows(paths):
+    rows = set()
+    for path in paths:
+        conn = sqlite3.connect(path)
+        for table in ("Users", "Booking", "Payment"):
+            rows.update((table,) + tuple(row) for row in conn.execute(f"SELECT * FROM {table}"))
+        conn.close()
+    return rows
+
+
+def test_rebalance_round_trip(database):
+    service.book(1, *ITINERARY)
+    before = _user_rows([database])
+    db.get_pool().close_all()
+
+    shards.rebalance(database, 0, 3)
+    paths = shards.shard_paths(database, 3)
+    assert _count(database, "SELECT COUNT(*) FROM Users") == 0
+    assert _user_rows(paths) == before
+    for index, path in enumerate(paths):
+        assert all(shards.shard_of(user_id, 3) == index
+                   for user_id, in sqlite3.connect(path).execute("SELECT UserID FROM Users"))
+
+    shards.configure(3)
+    db.configure(database, max_size=4)
+    user, user_id = service.login_user("user1", "pass1")
+    booking_id, _ = service.book(user_id, *ITINERARY)
+    assert service.get_booking(booking_id, user_id) is not None
+    assert service.cancel_booking(booking_id, user_id)
+    shards.configure(0)
+    db.get_pool().close_all()
+
+    shards.rebalance(database, 3, 0)
+    assert _user_rows([database]) >= before
+    assert all(_count(path, "SELECT COUNT(*) FROM Users") == 0 for path in paths)
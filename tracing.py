@@ -0,0 +1,232 @@
+import logging
+import os
+import sqlite3
+import sys
+import threading
+import time
+from collections import deque
+
+SLOW_QUERY_MS = float(os.environ.get('TRAVEL_BOOKING_SLOW_QUERY_MS', 100))
+SLOW_QUERY_LOG = os.environ.get('TRAVEL_BOOKING_SLOW_QUERY_LOG', 'slow_queries.log')
+# Upper bounds in seconds of the cumulative histogram buckets, as Prometheus expects
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+# Recent durations kept per call site for percentiles
+WINDOW = 1000
+
+slow_log = logging.getLogger('travel_booking.slow_queries')
+# Silent until configure_slow_log gives it a file, rather than falling back to stderr
+slow_log.addHandler(logging.NullHandler())
+
+
+class QueryStats:
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.rows = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.buckets = [0] * len(BUCKETS)
+        self.recent = deque(maxlen=WINDOW)
+        self.sql = ""
+
+    def observe(self, sql, elapsed, rows, failed):
+        self.count += 1
+        self.errors += failed
+        self.rows += rows
+        self.total += elapsed
+        self.max = max(self.max, elapsed)
+        self.recent.append(elapsed)
+        self.sql = sql
+        for i, bound in enumerate(BUCKETS):
+            if elapsed <= bound:
+                self.buckets[i] += 1
+                break
+
+    def summary(self):
+        recent = sorted(self.recent)
+        pick = lambda fraction: recent[min(len(recent) - 1, int(fraction * len(recent)))] * 1000 if recent else 0.0
+        return {
+            "count": self.count,
+            "errors": self.errors,
+            "rows": self.rows,
+            "total_ms": self.total * 1000,
+            "mean_ms": self.total / self.count * 1000 if self.count else 0.0,
+            "p50_ms": pick(0.50),
+            "p95_ms": pick(0.95),
+            "p99_ms": pick(0.99),
+            "max_ms": self.max * 1000,
+            "sql": " ".join(self.sql.split()),
+        }
+
+
+class Tracer:
+    def __init__(self, slow_query_ms=SLOW_QUERY_MS):
+        self.slow_query_ms = slow_query_ms
+        self.enabled = True
+        self._lock = threading.Lock()
+        self._stats = {}
+
+    def record(self, site, sql, elapsed, rows, failed=False):
+        with self._lock:
+            stats = self._stats.get(site)
+            if stats is None:
+                stats = self._stats[site] = QueryStats()
+            stats.observe(sql, elapsed, rows, failed)
+        if elapsed * 1000 >= self.slow_query_ms:
+            slow_log.warning("%.1fms rows=%d site=%s sql=%s", elapsed * 1000, rows, site, " ".join(sql.split()))
+
+    def snapshot(self):
+        with self._lock:
+            return {site: stats.summary() for site, stats in self._stats.items()}
+
+    def reset(self):
+        with self._lock:
+            self._stats = {}
+
+    def prometheus(self):
+        lines = [
+            "# HELP travel_booking_query_seconds Time spent executing and fetching SQL queries.",
+            "# TYPE travel_booking_query_seconds histogram",
+        ]
+        with self._lock:
+            items = sorted(self._stats.items())
+            for site, stats in items:
+                cumulative = 0
+                for bound, count in zip(BUCKETS, stats.buckets):
+                    cumulative += count
+                    lines.append(f'travel_booking_query_seconds_bucket{{site="{site}",le="{bound}"}} {cumulative}')
+                lines.append(f'travel_booking_query_seconds_bucket{{site="{site}",le="+Inf"}} {stats.count}')
+                lines.append(f'travel_booking_query_seconds_sum{{site="{site}"}} {stats.total}')
+                lines.append(f'travel_booking_query_seconds_count{{site="{site}"}} {stats.count}')
+            lines.append("# HELP travel_booking_query_rows_total Rows returned by SQL queries.")
+            lines.append("# TYPE travel_booking_query_rows_total counter")
+            for site, stats in items:
+                lines.append(f'travel_booking_query_rows_total{{site="{site}"}} {stats.rows}')
+            lines.append("# HELP travel_booking_query_errors_total SQL queries that raised.")
+            lines.append("# TYPE travel_booking_query_errors_total counter")
+            for site, stats in items:
+                lines.append(f'travel_booking_query_errors_total{{site="{site}"}} {stats.errors}')
+        return "\n".join(lines) + "\n"
+
+
+tracer = Tracer()
+
+
+def call_site():
+    frame = sys._getframe(2)
+    while frame is not None and frame.f_code.co_filename == __file__:
+        frame = frame.f_back
+    if frame is None:
+        return "unknown"
+    module = os.path.splitext(os.path.basename(frame.f_code.co_filename))[0]
+    return f"{module}.{frame.f_code.co_name}"
+
+
+class TracedCursor(sqlite3.Cursor):
+    # Times each statement from execute until its rows are consumed, the cursor is
+    # reused or it is discarded, counting the rows fetched along the way
+    _trace = None
+
+    def _begin(self, sql, site):
+        self._finish()
+        self._trace = [site or call_site(), sql, 0.0, 0, False]
+
+    def _timed(self, method, *args):
+        start = time.perf_counter()
+        try:
+            return method(*args)
+        except StopIteration:
+            raise
+        except BaseException:
+            if self._trace is not None:
+                self._trace[4] = True
+            raise
+        finally:
+            if self._trace is not None:
+                self._trace[2] += time.perf_counter() - start
+
+    def _finish(self):
+        trace, self._trace = self._trace, None
+        if trace is not None and tracer.enabled:
+            site, sql, elapsed, rows, failed = trace
+            tracer.record(site, sql, elapsed, rows or max(self.rowcount, 0), failed)
+
+    def execute(self, sql, parameters=(), site=None):
+        self._begin(sql, site)
+        try:
+            self._timed(super().execute, sql, parameters)
+        except BaseException:
+            self._finish()
+            raise
+        if self.description is None:
+            self._finish()
+        return self
+
+    def executemany(self, sql, seq_of_parameters, site=None):
+        self._begin(sql, site)
+        try:
+            self._timed(super().executemany, sql, seq_of_parameters)
+        finally:
+            self._finish()
+        return self
+
+    def fetchone(self):
+        row = self._timed(super().fetchone)
+        if row is None:
+            self._finish()
+        elif self._trace is not None:
+            self._trace[3] += 1
+        return row
+
+    def fetchmany(self, size=None):
+        rows = self._timed(super().fetchmany, self.arraysize if size is None else size)
+        if self._trace is not None:
+            self._trace[3] += len(rows)
+        if not rows:
+            self._finish()
+        return rows
+
+    def fetchall(self):
+        rows = self._timed(super().fetchall)
+        if self._trace is not None:
+            self._trace[3] += len(rows)
+        self._finish()
+        return rows
+
+    def __next__(self):
+        try:
+            row = self._timed(super().__next__)
+        except StopIteration:
+            self._finish()
+            raise
+        if self._trace is not None:
+            self._trace[3] += 1
+        return row
+
+    def close(self):
+        self._finish()
+        super().close()
+
+    def __del__(self):
+        self._finish()
+
+
+class TracedConnection(sqlite3.Connection):
+    def cursor(self, factory=TracedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters, call_site())
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters, call_site())
+
+
+def configure_slow_log(path=SLOW_QUERY_LOG, threshold_ms=None):
+    if threshold_ms is not None:
+        tracer.slow_query_ms = threshold_ms
+    if path and not any(getattr(handler, "baseFilename", None) == os.path.abspath(path) for handler in slow_log.handlers):
+        handler = logging.FileHandler(path)
+        handler.setFormatter(logging.Formatter("%(asctime)s %(message)s"))
+        slow_log.addHandler(handler)
+        slow_log.propagate = False
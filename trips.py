@@ -0,0 +1,58 @@
+import heapq
+import itertools
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import service
+
+BUNDLE_LIMIT = 10
+Trip = namedtuple("Trip", ["dept_airport", "arrival_airport", "dept_date",
+                           "hotel_location", "entry_date", "exit_date",
+                           "car_location", "pickup_date", "drop_date"])
+Bundle = namedtuple("Bundle", ["total", "flight", "hotel", "car"])
+
+PRICE_INDEX = {
+    "flights": service.FLIGHT_COLUMNS.index("Price"),
+    "hotels": service.HOTEL_COLUMNS.index("Price"),
+    "cars": service.CAR_COLUMNS.index("Price"),
+}
+AVAILABLE_INDEX = service.CAR_COLUMNS.index("IsAvailable")
+
+_executor = ThreadPoolExecutor(max_workers=12, thread_name_prefix="trip-search")
+
+
+def _price(kind, row):
+    return row[PRICE_INDEX[kind]]
+
+
+def rank_bundles(flights, hotels, cars, limit=BUNDLE_LIMIT):
+    # Cheapest flight + hotel + car combinations, skipping cars marked unavailable
+    # The top N bundles can only use the N cheapest options of each kind
+    cars = [car for car in cars if car[AVAILABLE_INDEX] != "No"]
+    flights = heapq.nsmallest(limit, flights, key=lambda row: _price("flights", row))
+    hotels = heapq.nsmallest(limit, hotels, key=lambda row: _price("hotels", row))
+    cars = heapq.nsmallest(limit, cars, key=lambda row: _price("cars", row))
+    combos = itertools.product(flights, hotels, cars)
+    best = heapq.nsmallest(limit, combos, key=lambda c: _price("cars", c[2]) + _price("hotels", c[1]) + _price("flights", c[0]))
+    return [Bundle(_price("cars", car) + _price("hotels", hotel) + _price("flights", flight), flight, hotel, car)
+            for flight, hotel, car in best]
+
+
+def search_trip_stream(trip, limit=BUNDLE_LIMIT):
+    # Runs the three searches at once and yields (kind, rows) as each one finishes,
+    # then ("bundles", ranked bundles) once all three are in
+    futures = {
+        _executor.submit(service.search_flights, trip.dept_airport, trip.arrival_airport, trip.dept_date): "flights",
+        _executor.submit(service.search_hotels, trip.hotel_location, trip.entry_date, trip.exit_date): "hotels",
+        _executor.submit(service.search_cars, trip.car_location, trip.pickup_date, trip.drop_date): "cars",
+    }
+    results = {}
+    try:
+        for future in as_completed(futures):
+            kind = futures[future]
+            results[kind] = future.result()
+            yield kind, results[kind]
+    finally:
+        for future in futures:
+            future.cancel()
+    yield "bundles", rank_bundles(results["flights"], results["hotels"], results["cars"], limit)